@@ -0,0 +1,99 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_yasg import openapi
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+# Idempotency keys for endpoints that clients retry. A request sent with an ``Idempotency-Key``
+# header claims the key by inserting its row before running the handler, and fills in the
+# successful response in the same transaction as the handler's writes. A retry then costs one
+# indexed lookup and gets the stored response back. If two copies race, the second one's insert
+# blocks on the unique index until the first commits, then fails, and the second replays the
+# first one's response without ever running the handler. Error responses are not stored: they
+# write nothing, the claim is dropped with them, and the client may simply retry.
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+IDEMPOTENCY_KEY_PARAMETER = openapi.Parameter(
+    name=HEADER,
+    in_=openapi.IN_HEADER,
+    type=openapi.TYPE_STRING,
+    description="Unique key for this request. Retries with the same key and body replay the first response.",
+    required=False,
+)
+
+
+def request_fingerprint(request) -> str:
+    payload = json.dumps([request.method, request.path, request.data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def expiry_cutoff():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired_keys() -> int:
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expiry_cutoff()).delete()
+    return deleted
+
+
+def replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(handler):
+    """Make a view method honour the ``Idempotency-Key`` header."""
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be between 1 and {MAX_KEY_LENGTH} characters.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if stored is not None and stored.created_at >= expiry_cutoff():
+            return replay(stored, fingerprint)
+
+        try:
+            with transaction.atomic():
+                if stored is not None:
+                    stored.delete()
+                # The status code is a placeholder; nobody sees the row before it is filled in.
+                claim = IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=fingerprint, status_code=0
+                )
+                response = handler(view, request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    claim.status_code, claim.response = response.status_code, response.data
+                    claim.save(update_fields=['status_code', 'response'])
+                else:
+                    claim.delete()
+        except IntegrityError:
+            stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if stored is None:
+                raise
+            return replay(stored, fingerprint)
+        return response
+
+    return wrapper
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from customer.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete stored idempotency keys older than IDEMPOTENCY_KEY_TTL. Run it periodically, e.g. hourly from cron."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
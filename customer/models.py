@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
@@ -50,4 +51,20 @@ class CartItem(models.Model):
     discount = models.PositiveIntegerField(default=0, help_text="Discount percentage (0 to 100)")
 
     def __str__(self):
-        return f"{self.count} x {self.item.name} in cart for {self.cart.user}"
\ No newline at end of file
+        return f"{self.count} x {self.item.name} in cart for {self.cart.user}"
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a request sent with an ``Idempotency-Key`` header, kept so retries of the same
+    request get the stored response instead of repeating the write. Only the hash of the
+    request is stored; rows older than ``IDEMPOTENCY_KEY_TTL`` are purged.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
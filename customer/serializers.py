@@ -52,11 +52,26 @@ class FavoriteSerializer(serializers.ModelSerializer):
 class AddToCartSerializer(serializers.Serializer):
     restaurant_id = serializers.IntegerField()
     item_id = serializers.IntegerField()
-    count = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1)
 
 class UpdateCartItemSerializer(serializers.Serializer):
     cart_item_id = serializers.IntegerField()
-    count = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=0)
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    item_id = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and not attrs.get('count'):
+            raise serializers.ValidationError({'count': "A positive count is required to add an item."})
+        if attrs['op'] == 'set' and 'count' not in attrs:
+            raise serializers.ValidationError({'count': "This field is required to set a quantity."})
+        return attrs
+
+class CartBatchUpdateSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
 
 class CartItemSerializer(serializers.ModelSerializer):
     name = serializers.CharField(source="item.name", read_only=True)
@@ -0,0 +1,167 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import DecimalField, F, Prefetch, Sum
+from rest_framework.exceptions import NotFound, ValidationError
+
+from order.models import Order, OrderItem
+from order.services import OrderLifecycle
+from restaurant.models import Item
+from .models import Cart, CartItem
+
+
+class CartService:
+    """
+    Mutates the carts of a user. Every change locks the cart row first, so concurrent requests
+    for the same cart are applied one after the other, and counts are changed in the database
+    with F() expressions rather than read-modify-write in Python.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @staticmethod
+    def for_serialization(queryset):
+        """Load everything ``CartSerializer`` reads in two queries, however many carts and lines."""
+        return queryset.select_related('restaurant').prefetch_related(
+            Prefetch('cart_items', queryset=CartItem.objects.select_related('item').order_by('pk'))
+        )
+
+    def get_cart(self, cart_id: int) -> Cart:
+        """The user's cart, ready for serialization."""
+        try:
+            return self.for_serialization(Cart.objects.filter(user=self.user)).get(pk=cart_id)
+        except Cart.DoesNotExist:
+            raise NotFound("Cart not found.")
+
+    def add_item(self, restaurant, item, count: int) -> Cart:
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user=self.user, restaurant=restaurant)
+            cart = self._lock(cart.pk)
+            updated = CartItem.objects.filter(cart=cart, item=item).update(count=F('count') + count)
+            if not updated:
+                CartItem.objects.create(cart=cart, item=item, count=count, price=item.price, discount=item.discount)
+            self.update_total(cart)
+        return cart
+
+    def set_count(self, cart_id: int, cart_item_id: int, count: int) -> Cart:
+        """Set the quantity of a cart line; a count of 0 removes the line."""
+        with transaction.atomic():
+            cart = self._lock(cart_id)
+            lines = CartItem.objects.filter(pk=cart_item_id, cart=cart)
+            changed = lines.update(count=count) if count else lines.delete()[0]
+            if not changed:
+                raise NotFound("Cart item not found.")
+            self.update_total(cart)
+        return cart
+
+    def remove_item(self, cart_id: int, cart_item_id: int):
+        """Remove a cart line; the cart itself is deleted with its last line. Returns the cart or ``None``."""
+        with transaction.atomic():
+            cart = self._lock(cart_id)
+            deleted, _ = CartItem.objects.filter(pk=cart_item_id, cart=cart).delete()
+            if not deleted:
+                raise NotFound("Cart item not found.")
+            if not cart.cart_items.exists():
+                cart.delete()
+                return None
+            self.update_total(cart)
+        return cart
+
+    def apply_operations(self, cart_id: int, operations: list) -> Cart:
+        """
+        Apply a list of ``{'op': 'add' | 'set' | 'remove', 'item_id': ..., 'count': ...}`` to a cart, in order
+        and all or nothing. Referenced items are fetched with one query and the lines are written back in bulk.
+        """
+        with transaction.atomic():
+            cart = self._lock(cart_id)
+            items = Item.objects.in_bulk({operation['item_id'] for operation in operations})
+            unknown = sorted(
+                {op['item_id'] for op in operations if op['item_id'] not in items
+                 or items[op['item_id']].restaurant_id != cart.restaurant_id}
+            )
+            if unknown:
+                raise ValidationError({'operations': [f"Items not on this restaurant's menu: {unknown}."]})
+
+            lines = {line.item_id: line for line in cart.cart_items.all()}
+            original_counts = {item_id: line.count for item_id, line in lines.items()}
+            for operation in operations:
+                op, item, count = operation['op'], items[operation['item_id']], operation.get('count', 0)
+                line = lines.get(item.pk)
+                if op == 'remove' or (op == 'set' and count == 0):
+                    lines.pop(item.pk, None)
+                elif line is None:
+                    lines[item.pk] = CartItem(cart=cart, item=item, count=count, price=item.price, discount=item.discount)
+                elif op == 'add':
+                    line.count += count
+                else:
+                    line.count = count
+
+            created = [line for line in lines.values() if line.pk is None]
+            changed = [line for line in lines.values() if line.pk is not None and line.count != original_counts[line.item_id]]
+            # A stored line that was removed (and maybe added back as a new one) is deleted.
+            removed = [item_id for item_id in original_counts if item_id not in lines or lines[item_id].pk is None]
+            CartItem.objects.filter(cart=cart, item_id__in=removed).delete()
+            CartItem.objects.bulk_create(created)
+            CartItem.objects.bulk_update(changed, ['count'])
+            self.update_total(cart)
+        return cart
+
+    def checkout(self, cart_id: int, delivery_method: str, payment_method: str, description: str = '') -> Order:
+        """
+        Turn a cart into an order, all or nothing. The cart row stays locked until the order is
+        committed, so a concurrent edit or a second checkout of the same cart waits and then finds
+        it gone. The number of queries does not depend on the number of lines.
+        """
+        with transaction.atomic():
+            try:
+                cart = Cart.objects.select_for_update(of=('self',)).select_related('restaurant').get(
+                    pk=cart_id, user=self.user
+                )
+            except Cart.DoesNotExist:
+                raise NotFound("Cart not found.")
+            lines = list(cart.cart_items.select_related('item'))
+            if not lines:
+                raise ValidationError({'cart_id': ["Cart is empty."]})
+            unavailable = sorted(line.item.name for line in lines if line.item.state != 'available')
+            if unavailable:
+                raise ValidationError({'cart_id': [f"Items no longer available: {', '.join(unavailable)}."]})
+
+            delivery_price = 0 if delivery_method == 'delivery' else cart.restaurant.delivery_price
+            order = Order.objects.create(
+                user=cart.user,
+                restaurant=cart.restaurant,
+                total_price=cart.total_price + delivery_price,
+                delivery_method=delivery_method,
+                payment_method=payment_method,
+                description=description,
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item=line.item, count=line.count, price=line.price, discount=line.discount)
+                for line in lines
+            ])
+            OrderLifecycle(order, actor=self.user).record_placed()
+            cart.delete()
+        return order
+
+    @staticmethod
+    def calculate_total(cart) -> Decimal:
+        """Sum of price x count less the line discount, computed by the database in one aggregate."""
+        # Multiply by (100 - discount) and divide once at the end, so the database only does exact
+        # decimal/integer arithmetic.
+        total = cart.cart_items.aggregate(
+            total=Sum(
+                F('price') * F('count') * (100 - F('discount')),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            )
+        )['total']
+        return (Decimal(total or 0) / 100).quantize(Decimal('0.01'))
+
+    def update_total(self, cart):
+        cart.total_price = self.calculate_total(cart)
+        cart.save(update_fields=['total_price'])
+
+    def _lock(self, cart_id) -> Cart:
+        try:
+            return Cart.objects.select_for_update().get(pk=cart_id, user=self.user)
+        except Cart.DoesNotExist:
+            raise NotFound("Cart not found.")
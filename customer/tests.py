@@ -1,12 +1,24 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from django.db import connection
+from django.db.models import QuerySet
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
 
-from .models import CustomerProfile, Favorite, Cart, CartItem
+from .models import CustomerProfile, Favorite, Cart, CartItem, IdempotencyKey
 from restaurant.models import RestaurantProfile, Item
 from order.models import Order, OrderItem, Review
 from .serializers import CustomerProfileSerializer
+from .services import CartService
 
 User = get_user_model()
 
@@ -159,6 +171,121 @@ class TestCartListCreateView(APITestCase):
         response = self.client.post(self.list_create_url, data=data, format="json")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+class TestCartService(TransactionTestCase):
+    def setUp(self):
+        self.customer_user = User.objects.create_user(
+            phone_number="9998880001",
+            password="cart_pass",
+            first_name="Bob",
+            role="customer",
+        )
+        manager_user = User.objects.create_user(
+            phone_number="6665550001",
+            password="manager_cart_pass",
+            first_name="ManagerCart",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager_user, name="Busy Restaurant")
+        self.item = Item.objects.create(name="Kebab", price=10.00, discount=20, restaurant=self.restaurant)
+        self.other_item = Item.objects.create(name="Ayran", price=2.50, discount=0, restaurant=self.restaurant)
+
+    def test_total_respects_line_discounts(self):
+        service = CartService(self.customer_user)
+        service.add_item(self.restaurant, self.item, 3)
+        cart = service.add_item(self.restaurant, self.other_item, 1)
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_price, Decimal("26.50"))
+
+    @skipUnless(connection.features.has_select_for_update, "needs row locks; in-memory SQLite rejects concurrent writers")
+    def test_concurrent_adds_to_one_cart_are_not_lost(self):
+        threads_count, adds_per_thread = 8, 5
+        errors = []
+
+        def hammer():
+            try:
+                service = CartService(self.customer_user)
+                for _ in range(adds_per_thread):
+                    service.add_item(self.restaurant, self.item, 1)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hammer) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cart = Cart.objects.get(user=self.customer_user, restaurant=self.restaurant)
+        self.assertEqual(cart.cart_items.get().count, threads_count * adds_per_thread)
+        self.assertEqual(cart.total_price, Decimal("8.00") * threads_count * adds_per_thread)
+
+    def test_add_interleaved_with_another_add_is_not_lost(self):
+        # Another request adds the same item after this one found its cart but before it holds
+        # the cart's row lock, as when the other request wins the lock. This add must build on
+        # the line the other one wrote instead of a count read before the lock.
+        service, other = CartService(self.customer_user), CartService(self.customer_user)
+        lock = CartService._lock
+        interleaved = []
+
+        def lock_after_other_add(instance, cart_id):
+            if not interleaved:
+                interleaved.append(cart_id)
+                other.add_item(self.restaurant, self.item, 2)
+            return lock(instance, cart_id)
+
+        with mock.patch.object(CartService, "_lock", lock_after_other_add):
+            service.add_item(self.restaurant, self.item, 1)
+
+        self.assertEqual(len(interleaved), 1)
+        cart = Cart.objects.get(user=self.customer_user, restaurant=self.restaurant)
+        self.assertEqual(cart.cart_items.get().count, 3)
+        self.assertEqual(cart.total_price, Decimal("8.00") * 3)
+
+class TestCartQueryCount(APITestCase):
+    def setUp(self):
+        self.customer_user = User.objects.create_user(
+            phone_number="9998880002",
+            password="cart_pass",
+            first_name="Bob",
+            role="customer",
+        )
+        self.client.force_authenticate(user=self.customer_user)
+
+    def _fill_carts(self, carts, lines):
+        for c in range(carts):
+            manager = User.objects.create_user(
+                phone_number=f"66655{Cart.objects.count():05d}", password="x", role="restaurant_manager"
+            )
+            restaurant = RestaurantProfile.objects.create(manager=manager, name=f"Restaurant {c}")
+            cart = Cart.objects.create(user=self.customer_user, restaurant=restaurant)
+            for i in range(lines):
+                item = Item.objects.create(name=f"Dish {i}", price=2.00, restaurant=restaurant)
+                CartItem.objects.create(cart=cart, item=item, count=1, price=2.00)
+        return cart
+
+    def test_cart_list_uses_a_fixed_number_of_queries(self):
+        self._fill_carts(1, 1)
+        with self.assertNumQueries(2):
+            self.client.get(reverse("cart-list-create"))
+
+        self._fill_carts(4, 10)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("cart-list-create"))
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response.data[-1]["cart_items"][-1]["name"], "Dish 9")
+
+    def test_mutation_responses_use_the_fixed_read_path(self):
+        cart = self._fill_carts(1, 10)
+        line = cart.cart_items.first()
+        with self.assertNumQueries(8):
+            response = self.client.put(
+                reverse("cart-detail", kwargs={"id": cart.id}), {"cart_item_id": line.id, "count": 2}, format="json"
+            )
+        self.assertEqual(len(response.data["cart_items"]), 10)
+
 class TestCartDetailView(APITestCase):
     def setUp(self):
         self.customer_user = User.objects.create_user(
@@ -219,6 +346,65 @@ class TestCartDetailView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(Cart.objects.filter(id=self.cart.id).exists())
 
+class TestCartBatchUpdateView(APITestCase):
+    def setUp(self):
+        self.customer_user = User.objects.create_user(
+            phone_number="7776660001",
+            password="cart_batch_pass",
+            first_name="Charlie",
+            role="customer",
+        )
+        manager_user = User.objects.create_user(
+            phone_number="3334440001",
+            password="manager_batch_pass",
+            first_name="ManagerBatch",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager_user, name="Batch Restaurant")
+        self.items = [
+            Item.objects.create(name=f"Dish {i}", price=5.00, discount=0, restaurant=self.restaurant)
+            for i in range(4)
+        ]
+        self.cart = Cart.objects.create(user=self.customer_user, restaurant=self.restaurant, total_price=15.00)
+        self.line = CartItem.objects.create(cart=self.cart, item=self.items[0], count=3, price=5.00, discount=0)
+        CartItem.objects.create(cart=self.cart, item=self.items[1], count=1, price=5.00, discount=0)
+        self.client.force_authenticate(user=self.customer_user)
+        self.url = reverse("cart-batch-update", kwargs={"id": self.cart.id})
+
+    def test_operations_are_applied_in_one_request(self):
+        operations = [
+            {"op": "set", "item_id": self.items[0].item_id, "count": 1},
+            {"op": "remove", "item_id": self.items[1].item_id},
+            {"op": "add", "item_id": self.items[2].item_id, "count": 2},
+            {"op": "add", "item_id": self.items[2].item_id, "count": 1},
+            {"op": "set", "item_id": self.items[3].item_id, "count": 4},
+        ]
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        counts = {line["item"]: line["count"] for line in response.data["cart_items"]}
+        self.assertEqual(counts, {self.items[0].item_id: 1, self.items[2].item_id: 3, self.items[3].item_id: 4})
+        self.assertEqual(Decimal(response.data["total_price"]), Decimal("40.00"))
+        # The existing line was updated in place rather than replaced.
+        self.assertTrue(CartItem.objects.filter(pk=self.line.pk, count=1).exists())
+
+    def test_invalid_operation_changes_nothing(self):
+        other_restaurant = RestaurantProfile.objects.create(
+            manager=User.objects.create_user(phone_number="3334440002", password="x", role="restaurant_manager"),
+            name="Elsewhere",
+        )
+        foreign = Item.objects.create(name="Foreign", price=1.00, restaurant=other_restaurant)
+        operations = [
+            {"op": "remove", "item_id": self.items[0].item_id},
+            {"op": "add", "item_id": foreign.item_id, "count": 1},
+        ]
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(CartItem.objects.filter(pk=self.line.pk).exists())
+
+        response = self.client.post(self.url, {"operations": [{"op": "add", "item_id": self.items[0].item_id}]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 class TestCartItemDeleteView(APITestCase):
     def setUp(self):
         self.customer_user = User.objects.create_user(
@@ -303,9 +489,9 @@ class TestMenuItemsView(APITestCase):
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]["name"], "Steak")
-        self.assertEqual(response.data[1]["name"], "Fries")
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(response.json()[0]["name"], "Steak")
+        self.assertEqual(response.json()[1]["name"], "Fries")
 
     def test_get_menu_items_restaurant_not_found(self):
 
@@ -314,6 +500,31 @@ class TestMenuItemsView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn("detail", response.data)
 
+    def test_unchanged_menu_returns_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertTrue(etag.startswith('"'))
+
+        # Only the menu version is looked up.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_item_changes_bump_menu_version(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.item2.price = 6.00
+        self.item2.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        self.item1.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+
 class TestMenuItemDetailView(APITestCase):
     def setUp(self):
         self.manager_user = User.objects.create_user(
@@ -339,8 +550,8 @@ class TestMenuItemDetailView(APITestCase):
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["name"], "Soup")
-        self.assertEqual(response.data["price"], "3.00") 
+        self.assertEqual(response.json()["name"], "Soup")
+        self.assertEqual(response.json()["price"], "3.00") 
 
     def test_get_menu_item_not_found(self):
 
@@ -416,6 +627,160 @@ class TestOrderListCreateView(APITestCase):
         self.assertIsNotNone(order_item)
         self.assertEqual(order_item.count, 1)
         self.assertEqual(order_item.price, 8.00)
+        self.assertEqual(list(order.events.values_list("to_state", "actor")), [("pending", self.customer_user.pk)])
+
+    def _order_data(self, cart):
+        return {"cart_id": cart.id, "delivery_method": "pickup", "payment_method": "online"}
+
+    def test_post_create_order_of_another_users_cart(self):
+        other = User.objects.create_user(phone_number="5551230099", password="x", role="customer")
+        self.client.force_authenticate(user=other)
+        response = self.client.post(self.list_create_url, data=self._order_data(self.cart), format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Cart.objects.filter(id=self.cart.id).exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_post_create_order_empty_cart(self):
+        self.cart_item.delete()
+        response = self.client.post(self.list_create_url, data=self._order_data(self.cart), format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_post_create_order_with_unavailable_item_rolls_back(self):
+        Item.objects.filter(pk=self.item.pk).update(state="unavailable")
+        response = self.client.post(self.list_create_url, data=self._order_data(self.cart), format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Taco", str(response.data))
+        self.assertTrue(Cart.objects.filter(id=self.cart.id).exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_cost_does_not_grow_with_the_cart(self):
+        # Checkout benchmark: the same number of queries for 1 line and for 40.
+        def checkout():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.list_create_url, data=self._order_data(cart), format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        cart = self.cart
+        small = checkout()
+
+        cart = Cart.objects.create(user=self.customer_user, restaurant=self.restaurant, total_price=80.00)
+        for i in range(40):
+            item = Item.objects.create(name=f"Dish {i}", price=2.00, restaurant=self.restaurant)
+            CartItem.objects.create(cart=cart, item=item, count=1, price=2.00)
+        self.assertEqual(checkout(), small)
+
+        order = Order.objects.latest("order_id")
+        self.assertEqual(order.order_items.count(), 40)
+        self.assertEqual(order.total_price, Decimal("85.00"))
+
+class TestIdempotencyKeys(APITestCase):
+    def setUp(self):
+        self.customer_user = User.objects.create_user(
+            phone_number="5554440001", password="retry_pass", role="customer"
+        )
+        manager = User.objects.create_user(
+            phone_number="5554440002", password="retry_pass", role="restaurant_manager"
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager, name="Retry Restaurant")
+        self.item = Item.objects.create(name="Soup", price=4.00, restaurant=self.restaurant)
+        self.client.force_authenticate(user=self.customer_user)
+        self.cart_url = reverse("cart-list-create")
+        self.cart_data = {"restaurant_id": self.restaurant.id, "item_id": self.item.item_id, "count": 2}
+
+    def test_retried_add_to_cart_is_applied_once(self):
+        first = self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            retry = self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(CartItem.objects.get(item=self.item).count, 2)
+
+        self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-2")
+        self.assertEqual(CartItem.objects.get(item=self.item).count, 4)
+
+    def test_without_a_key_every_request_is_applied(self):
+        self.client.post(self.cart_url, self.cart_data, format="json")
+        self.client.post(self.cart_url, self.cart_data, format="json")
+        self.assertEqual(CartItem.objects.get(item=self.item).count, 4)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_retried_checkout_creates_one_order(self):
+        self.client.post(self.cart_url, self.cart_data, format="json")
+        data = {"cart_id": Cart.objects.get().id, "delivery_method": "pickup", "payment_method": "online"}
+        first = self.client.post(reverse("order-list-create"), data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        retry = self.client.post(reverse("order-list-create"), data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json()["order_id"], first.json()["order_id"])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_racing_checkout_replays_without_running_twice(self):
+        self.client.post(self.cart_url, self.cart_data, format="json")
+        data = {"cart_id": Cart.objects.get().id, "delivery_method": "pickup", "payment_method": "online"}
+        url = reverse("order-list-create")
+        first = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+
+        # The duplicate looked the key up before the first request committed; it then meets the
+        # first one's row on the unique index and must replay instead of checking out again.
+        lookups = []
+        first_match = QuerySet.first
+
+        def miss_first_lookup(queryset):
+            lookups.append(queryset.model)
+            return None if len(lookups) == 1 else first_match(queryset)
+
+        with mock.patch.object(QuerySet, "first", miss_first_lookup), \
+                mock.patch.object(CartService, "checkout") as checkout:
+            retry = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="order-1")
+        checkout.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json()["order_id"], first.json()["order_id"])
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        response = self.client.post(
+            self.cart_url, {**self.cart_data, "count": 5}, format="json", HTTP_IDEMPOTENCY_KEY="add-1"
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(CartItem.objects.get(item=self.item).count, 2)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        other = User.objects.create_user(phone_number="5554440003", password="retry_pass", role="customer")
+        self.client.force_authenticate(user=other)
+        response = self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(CartItem.objects.get(cart__user=other).count, 2)
+
+    def test_error_responses_are_not_stored(self):
+        data = {**self.cart_data, "item_id": 99999}
+        response = self.client.post(self.cart_url, data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="x" * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_keys_are_reused_and_purged(self):
+        self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=120))
+
+        response = self.client.post(self.cart_url, self.cart_data, format="json", HTTP_IDEMPOTENCY_KEY="add-1")
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(CartItem.objects.get(item=self.item).count, 4)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=120))
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
 
 class TestCreateReviewView(APITestCase):
     def setUp(self):
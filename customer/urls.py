@@ -1,9 +1,11 @@
 from django.urls import path
-from .views import CustomerProfileView, FavoriteView, CartListCreateView, CartDetailView, GetItemReviewsView, CartItemDeleteView, MenuItemsView, MenuItemDetailView, OrderListCreateView, CreateReviewView
+from .views import CustomerProfileView, FavoriteView, CartListCreateView, CartDetailView, GetItemReviewsView, CartItemDeleteView, MenuItemsView, MenuItemDetailView, OrderListCreateView, CreateReviewView, \
+    CartBatchUpdateView
 
 urlpatterns = [
     path('carts', CartListCreateView.as_view(), name='cart-list-create'),
     path('carts/<int:id>', CartDetailView.as_view(), name='cart-detail'),
+    path('carts/<int:id>/items/batch', CartBatchUpdateView.as_view(), name='cart-batch-update'),
     path('carts/<int:id>/items/<int:cart_item_id>', CartItemDeleteView.as_view(), name='cart-item-delete'),
     path('restaurants/<int:restaurant_id>/items', MenuItemsView.as_view(), name='menu-items'),
     path('restaurants/<int:restaurant_id>/items/<int:item_id>', MenuItemDetailView.as_view(), name='menu-item-detail'),
@@ -1,6 +1,8 @@
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from rest_framework import generics, status
 from rest_framework.exceptions import NotFound
 from rest_framework.views import APIView
@@ -8,11 +10,15 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from restaurant.models import RestaurantProfile, Item
 from restaurant.serializers import ItemSerializer
+from restaurant.menu import menu_cache, menu_etag
 from order.serializers import OrderCreateSerializer, OrderSerializer, ReviewSerializer, GetReviewSerializer
 from order.models import Order, OrderItem, Review
-from .models import CustomerProfile, Favorite, Cart, CartItem
-from .serializers import CustomerProfileSerializer, FavoriteSerializer, AddToCartSerializer, UpdateCartItemSerializer, CartSerializer
+from .models import CustomerProfile, Favorite, Cart
+from .serializers import CustomerProfileSerializer, FavoriteSerializer, AddToCartSerializer, UpdateCartItemSerializer, CartSerializer, \
+    CartBatchUpdateSerializer
 from .permissions import IsCustomer
+from .services import CartService
+from .idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
 
 class CustomerProfileView(APIView):
     permission_classes = [IsAuthenticated, IsCustomer]
@@ -170,9 +176,10 @@ class CartListCreateView(generics.ListCreateAPIView):
         user = self.request.user
         restaurant_id = self.request.query_params.get('restaurant_id')
 
+        queryset = Cart.objects.filter(user=user)
         if restaurant_id:
-            return Cart.objects.filter(user=user, restaurant_id=restaurant_id)
-        return Cart.objects.filter(user=user)
+            queryset = queryset.filter(restaurant_id=restaurant_id)
+        return CartService.for_serialization(queryset)
 
     @swagger_auto_schema(
         operation_summary="Retrieve the cart list",
@@ -201,6 +208,7 @@ class CartListCreateView(generics.ListCreateAPIView):
     @swagger_auto_schema(
         request_body=AddToCartSerializer,
         operation_summary="Add an item to the cart",
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
         responses={
             201: openapi.Response(
                 description="Item successfully added to cart",
@@ -213,6 +221,7 @@ class CartListCreateView(generics.ListCreateAPIView):
             500: openapi.Response(description="Internal server error"),
         },
     )
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = AddToCartSerializer(data=request.data)
         if serializer.is_valid():
@@ -223,25 +232,10 @@ class CartListCreateView(generics.ListCreateAPIView):
             restaurant = get_object_or_404(RestaurantProfile, id=restaurant_id)
             item = get_object_or_404(Item, item_id=item_id)
 
-            cart, created = Cart.objects.get_or_create(user=request.user, restaurant=restaurant)
+            cart_service = CartService(request.user)
+            cart = cart_service.add_item(restaurant, item, count)
 
-            cart_item, item_created = CartItem.objects.get_or_create(
-                cart=cart,
-                item=item,
-                defaults={
-                    'count': count,
-                    'price': item.price,
-                    'discount': item.discount
-                }
-            )
-            if not item_created:
-                cart_item.count += count
-                cart_item.save()
-
-            cart.total_price = sum(ci.price * ci.count for ci in cart.cart_items.all())
-            cart.save()
-
-            cart_serializer = CartSerializer(cart)
+            cart_serializer = CartSerializer(cart_service.get_cart(cart.pk))
             return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -252,7 +246,7 @@ class CartDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'id'
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return CartService.for_serialization(Cart.objects.filter(user=self.request.user))
 
     @swagger_auto_schema(
         operation_summary="Retrieve a specific cart of the user",
@@ -293,24 +287,16 @@ class CartDetailView(generics.RetrieveUpdateDestroyAPIView):
         },
     )
     def put(self, request, *args, **kwargs):
-        cart = self.get_object()
         serializer = UpdateCartItemSerializer(data=request.data)
         if serializer.is_valid():
-            cart_item_id = serializer.validated_data['cart_item_id']
-            new_count = serializer.validated_data['count']
-
-            cart_item = get_object_or_404(CartItem, id=cart_item_id, cart=cart)
-
-            if new_count == 0:
-                cart_item.delete()
-            else:
-                cart_item.count = new_count
-                cart_item.save()
-
-            cart.total_price = sum(ci.price * ci.count for ci in cart.cart_items.all())
-            cart.save()
+            cart_service = CartService(request.user)
+            cart = cart_service.set_count(
+                self.kwargs['id'],
+                serializer.validated_data['cart_item_id'],
+                serializer.validated_data['count'],
+            )
 
-            cart_serializer = CartSerializer(cart)
+            cart_serializer = CartSerializer(cart_service.get_cart(cart.pk))
             return Response(cart_serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -332,6 +318,37 @@ class CartDetailView(generics.RetrieveUpdateDestroyAPIView):
     def patch(self, request, *args, **kwargs):
         return Response({"detail": "Method 'PATCH' not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+class CartBatchUpdateView(APIView):
+    permission_classes = [IsAuthenticated, IsCustomer]
+
+    @swagger_auto_schema(
+        request_body=CartBatchUpdateSerializer,
+        operation_summary="Apply several cart changes at once",
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
+        operation_description="Operations run in order, in one transaction: `add` increases a line by `count`, "
+                              "`set` sets its quantity (0 removes it) and `remove` deletes it. "
+                              "Either all of them are applied or none.",
+        responses={
+            200: openapi.Response(
+                description="Final state of the cart",
+                schema=CartSerializer()
+            ),
+            400: openapi.Response(description="Invalid input"),
+            401: openapi.Response(description="Unauthorized"),
+            403: openapi.Response(description="Forbidden"),
+            404: openapi.Response(description="Cart not found"),
+            500: openapi.Response(description="Internal server error"),
+        },
+    )
+    @idempotent
+    def post(self, request, id):
+        serializer = CartBatchUpdateSerializer(data=request.data)
+        if serializer.is_valid():
+            cart_service = CartService(request.user)
+            cart = cart_service.apply_operations(id, serializer.validated_data['operations'])
+            return Response(CartSerializer(cart_service.get_cart(cart.pk)).data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 class CartItemDeleteView(APIView):
     permission_classes = [IsAuthenticated, IsCustomer]
 
@@ -346,43 +363,35 @@ class CartItemDeleteView(APIView):
         },
     )
     def delete(self, request, id, cart_item_id):
-        cart = get_object_or_404(Cart, id=id, user=request.user)
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, cart=cart)
-
-        cart_item.delete()
-        
-        if cart.cart_items.count() == 0:
-            cart.delete()
-        else:
-            cart.total_price = sum(ci.price * ci.count for ci in cart.cart_items.all())
-            cart.save()
+        CartService(request.user).remove_item(id, cart_item_id)
 
         return Response({"message": "Cart item deleted."}, status=status.HTTP_200_OK)
     
-class MenuItemsView(generics.ListAPIView):
-    serializer_class = ItemSerializer
+class MenuItemsView(APIView):
 
     @swagger_auto_schema(
         operation_summary="List All Items of a Restaurant",
         responses={
             200: ItemSerializer(many=True),
+            304: openapi.Response(description="Menu unchanged since the ETag sent in If-None-Match"),
             404: openapi.Response(description="Restaurant not found"),
             500: openapi.Response(description="Internal server error"),
         },
     )
-    def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
-
-    def get_queryset(self):
-        restaurant_id = self.kwargs.get('restaurant_id')
-        if not RestaurantProfile.objects.filter(pk=restaurant_id).exists():
+    def get(self, request, restaurant_id):
+        rendered = menu_cache.get(restaurant_id)
+        if rendered is None:
             raise NotFound("Restaurant not found")
-        return Item.objects.filter(restaurant_id=restaurant_id)
 
-class MenuItemDetailView(generics.RetrieveAPIView):
-    serializer_class = ItemSerializer
-    lookup_field = 'item_id'
-    
+        etag = menu_etag(restaurant_id, rendered.version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(rendered.menu, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+class MenuItemDetailView(APIView):
+
     @swagger_auto_schema(
         operation_summary="Retrieve a Specific Item of a Restaurant",
         responses={
@@ -391,16 +400,11 @@ class MenuItemDetailView(generics.RetrieveAPIView):
             500: openapi.Response(description="Internal server error"),
         },
     )
-    def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
-
-    def get_object(self):
-        restaurant_id = self.kwargs.get('restaurant_id')
-        item_id = self.kwargs.get('item_id')
-        try:
-            return Item.objects.get(restaurant_id=restaurant_id, item_id=item_id)
-        except Item.DoesNotExist:
+    def get(self, request, restaurant_id, item_id):
+        rendered = menu_cache.get(restaurant_id)
+        if rendered is None or item_id not in rendered.items:
             raise NotFound("Item not found")
+        return HttpResponse(rendered.items[item_id], content_type='application/json')
 
 class OrderListCreateView(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
@@ -427,56 +431,33 @@ class OrderListCreateView(generics.ListCreateAPIView):
     @swagger_auto_schema(
         operation_summary="Create an order",
         request_body=OrderCreateSerializer,
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
         responses={
             201: openapi.Response("Order created successfully!"),
-            400: openapi.Response(description="Invalid input"),
+            400: openapi.Response(description="Invalid input, empty cart or unavailable items"),
             401: openapi.Response(description="Unauthorized"),
             403: openapi.Response(description="Forbidden"),
+            404: openapi.Response(description="Cart not found"),
             500: openapi.Response(description="Internal server error"),
         }
     )
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = OrderCreateSerializer(data=request.data)
         if serializer.is_valid():
             validated_data = serializer.validated_data
-            cart_id = validated_data['cart_id']
-            cart = get_object_or_404(Cart, id=cart_id)
-            restaurant = cart.restaurant
-            delivery_method = validated_data['delivery_method']
-            payment_method = validated_data['payment_method']
-            description = validated_data.get('description', '')
-
-            delivery_price = 0 if delivery_method == 'delivery' else restaurant.delivery_price
-            total_price = cart.total_price + delivery_price
-
-            order = Order.objects.create(
-                user=cart.user,
-                restaurant=cart.restaurant,
-                total_price=total_price,
-                delivery_method=delivery_method,
-                payment_method=payment_method,
-                description=description,
+            order = CartService(request.user).checkout(
+                validated_data['cart_id'],
+                delivery_method=validated_data['delivery_method'],
+                payment_method=validated_data['payment_method'],
+                description=validated_data.get('description', ''),
             )
-
-            cart_items = cart.cart_items.all()
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    item=cart_item.item,
-                    count=cart_item.count,
-                    price=cart_item.price,
-                    discount=cart_item.discount,
-                )
- 
-            cart.delete()
-
             return Response({
                 "order_id": order.order_id,
                 "message": "Order created successfully!"
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-
 class CreateReviewView(generics.CreateAPIView):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import json
+import logging
+import select
+import socket
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+
+# Publish/subscribe for live order events. The broker is chosen with the ORDER_EVENT_BROKER
+# setting; anything with the same three methods can replace the in-process one:
+#
+#   subscribe(channel) -> subscription with ``async get()`` returning the next message
+#                         and ``close()``; called from the event loop that will read it
+#   publish(channel, message) -> None; callable from any thread, never blocks
+#   subscriber_count(channel) -> number of subscribers, or any positive number when the
+#                                broker cannot tell; publishers skip work when it is 0
+#
+# Messages are JSON-serializable dicts; a broker that caps their size says so in
+# MAX_MESSAGE_BYTES. InProcessBroker only reaches subscribers in the same process, so it needs
+# publishers (the order views) and subscribers (the streams) served by one process.
+# PostgresBroker goes through the database and works across any number of processes.
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionOverflow(Exception):
+    """The subscriber fell too far behind and was dropped; it should resubscribe and catch up."""
+
+
+class Subscription:
+    def __init__(self, broker, channel, max_queued):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.overflowed = False
+
+    async def get(self):
+        if self.overflowed:
+            raise SubscriptionOverflow(self.channel)
+        message = await self.queue.get()
+        if message is None:
+            raise SubscriptionOverflow(self.channel)
+        return message
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def drop(self):
+        # Runs on the subscriber's loop, like deliver().
+        self.overflowed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def deliver(self, message):
+        # Runs on the subscriber's loop.
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class InProcessBroker:
+    MAX_QUEUED = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel) -> Subscription:
+        subscription = Subscription(self, channel, self.MAX_QUEUED)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's loop is closed.
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self, channel) -> int:
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+    def channels(self) -> set:
+        with self._lock:
+            return set(self._subscriptions)
+
+    def drop_all(self):
+        """End every subscription, e.g. after messages may have been lost; readers catch up from the log."""
+        with self._lock:
+            subscriptions = [subscription for group in self._subscriptions.values() for subscription in group]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.drop)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+class PostgresBroker:
+    """
+    Publishes with NOTIFY on the default database, so every process receives every message.
+    Each process LISTENs on one extra connection, held by a daemon thread, for the channels
+    its streams subscribed to, and fans notifications out to them through an InProcessBroker.
+    If that connection fails, the streams are dropped so clients reconnect and replay.
+    """
+    # PostgreSQL rejects NOTIFY payloads of 8000 bytes or more.
+    MAX_MESSAGE_BYTES = 7900
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self._local = InProcessBroker()
+        self._lock = threading.Lock()
+        self._listener = None
+        # Wakes the listener up to LISTEN on new channels right away.
+        self._wake_reader, self._wake_writer = socket.socketpair()
+
+    def subscribe(self, channel) -> Subscription:
+        subscription = self._local.subscribe(channel)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+        self._wake_writer.send(b'.')
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._local.unsubscribe(subscription)
+
+    def publish(self, channel, message):
+        payload = json.dumps(message, cls=DjangoJSONEncoder)
+        if len(payload.encode()) > self.MAX_MESSAGE_BYTES:
+            raise ValueError(f'Message for {channel} exceeds {self.MAX_MESSAGE_BYTES} bytes.')
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [channel, payload])
+
+    def subscriber_count(self, channel) -> int:
+        # Subscribers in other processes are unknown.
+        return 1
+
+    def _listen(self):
+        while True:
+            try:
+                self._serve()
+            except Exception:
+                logger.exception("Order event listener failed; reconnecting")
+            self._local.drop_all()
+            time.sleep(self.RECONNECT_SECONDS)
+
+    def _serve(self):
+        from psycopg2.extensions import quote_ident
+
+        wrapper = connections[self.using]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        connection.autocommit = True
+        listening = set()
+        try:
+            while True:
+                wanted = self._local.channels()
+                with connection.cursor() as cursor:
+                    for channel in wanted - listening:
+                        cursor.execute(f'LISTEN {quote_ident(channel, connection)}')
+                    for channel in listening - wanted:
+                        cursor.execute(f'UNLISTEN {quote_ident(channel, connection)}')
+                listening = wanted
+
+                readable, _, _ = select.select([connection, self._wake_reader], [], [])
+                if self._wake_reader in readable:
+                    self._wake_reader.recv(4096)
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    self._local.publish(notification.channel, json.loads(notification.payload))
+        finally:
+            connection.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.ORDER_EVENT_BROKER)()
@@ -32,10 +32,46 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, default='in_person')
     description = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # A restaurant's orders, newest first: all of them, or only those in some states.
+            models.Index(fields=['restaurant', 'order_date']),
+            models.Index(fields=['restaurant', 'state', 'order_date']),
+        ]
+
     def __str__(self):
         return f"Order {self.order_id} by {self.user}"
 
 
+class OrderEvent(models.Model):
+    """
+    Append-only log of order state changes, written by ``OrderLifecycle``. ``from_state`` is empty
+    for the event recorded when the order is placed. The restaurant is copied from the order so
+    a restaurant's recent events can be read from one index.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    restaurant = models.ForeignKey('restaurant.RestaurantProfile', on_delete=models.CASCADE, related_name='+')
+    from_state = models.CharField(max_length=20, choices=Order.STATE_CHOICES, blank=True)
+    to_state = models.CharField(max_length=20, choices=Order.STATE_CHOICES)
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+            models.Index(fields=['restaurant', 'created_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order events are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_state or '-'} -> {self.to_state}"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items')
     item = models.ForeignKey('restaurant.Item', on_delete=models.CASCADE, related_name='order_items')
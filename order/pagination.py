@@ -0,0 +1,12 @@
+from restaurant.pagination import KeysetPagination
+
+
+class RestaurantOrderPagination(KeysetPagination):
+    """
+    Newest orders first. The cursor holds the ``order_date`` and ``order_id`` of the last order
+    sent, so every page is an index range scan however deep the history goes and however many
+    orders share a timestamp.
+    """
+    page_size = 50
+    max_page_size = 200
+    ordering = ('-order_date', '-order_id')
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Order, OrderItem, Review
+from .models import Order, OrderEvent, OrderItem, Review
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -40,10 +40,35 @@ class OrderListSerializer(serializers.ModelSerializer):
         ]
 
 
+class OrderListFilterSerializer(serializers.Serializer):
+    state = serializers.CharField(required=False, help_text="Comma-separated order states.")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate_state(self, value):
+        states = [state.strip() for state in value.split(',') if state.strip()]
+        unknown = sorted(set(states) - {state for state, _ in Order.STATE_CHOICES})
+        if unknown:
+            raise serializers.ValidationError(f"Unknown states: {', '.join(unknown)}.")
+        return states
+
+    def validate(self, attrs):
+        if 'date_from' in attrs and 'date_to' in attrs and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("'date_from' must not be after 'date_to'.")
+        return attrs
+
+
 class OrderStatusUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['state']
+        extra_kwargs = {'state': {'required': True}}
+
+
+class OrderEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderEvent
+        fields = ['id', 'order', 'from_state', 'to_state', 'actor', 'created_at']
 
 
 class OrderCreateSerializer(serializers.Serializer):
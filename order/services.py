@@ -1,7 +1,12 @@
-from rest_framework.exceptions import NotFound
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 
 from restaurant.models import RestaurantProfile
-from .models import Order
+from .models import Order, OrderEvent, OrderItem
 
 
 class RestaurantResolver:
@@ -23,11 +28,80 @@ class RestaurantOrderService:
     def __init__(self, restaurant: RestaurantProfile):
         self.restaurant = restaurant
 
-    def list_orders(self):
-        return Order.objects.filter(restaurant=self.restaurant)
+    def list_orders(self, states=None, date_from=None, date_to=None):
+        """
+        The restaurant's orders, optionally only those in ``states`` and placed between the dates
+        ``date_from`` and ``date_to`` (both inclusive, in the current time zone), loaded with
+        everything ``OrderListSerializer`` reads.
+        """
+        orders = Order.objects.filter(restaurant=self.restaurant)
+        if states:
+            orders = orders.filter(state__in=states)
+        # Compare against datetimes rather than order_date__date, so the indexes on order_date apply.
+        if date_from:
+            orders = orders.filter(order_date__gte=self._start_of(date_from))
+        if date_to:
+            orders = orders.filter(order_date__lt=self._start_of(date_to + timedelta(days=1)))
+        return orders.select_related('user__customer_profile').prefetch_related(
+            Prefetch('order_items', queryset=OrderItem.objects.select_related('item').order_by('pk'))
+        )
+
+    @staticmethod
+    def _start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
 
     def get_order_by_id(self, order_id: int) -> Order:
         try:
             return Order.objects.get(restaurant=self.restaurant, order_id=order_id)
         except Order.DoesNotExist:
             raise NotFound(detail="Order not found")
+
+
+class OrderStateConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The order was updated by another request; reload it and try again."
+    default_code = 'conflict'
+
+
+class OrderLifecycle:
+    """
+    Moves an order through ``Order.STATE_CHOICES``. A transition is a compare-and-set: the
+    UPDATE only matches while the row still holds the state the caller saw, so of two
+    concurrent changes one wins and the other gets a 409 instead of silently overwriting it.
+    Every change is appended to ``OrderEvent`` in the same transaction.
+    """
+
+    TRANSITIONS = {
+        'pending': {'preparing'},
+        'preparing': {'ready_for_pickup', 'delivering'},
+        'ready_for_pickup': {'delivering', 'completed'},
+        'delivering': {'completed'},
+        'completed': set(),
+    }
+
+    def __init__(self, order: Order, actor=None):
+        self.order = order
+        self.actor = actor
+
+    def record_placed(self) -> OrderEvent:
+        """Log the creation of a new order; call it in the transaction that created it."""
+        return OrderEvent.objects.create(
+            order=self.order, restaurant_id=self.order.restaurant_id, to_state=self.order.state, actor=self.actor
+        )
+
+    def can_transition(self, state: str) -> bool:
+        return state in self.TRANSITIONS.get(self.order.state, ())
+
+    def transition(self, state: str) -> OrderEvent:
+        expected = self.order.state
+        if not self.can_transition(state):
+            raise ValidationError({'state': [f"Cannot change an order from '{expected}' to '{state}'."]})
+        with transaction.atomic():
+            if not Order.objects.filter(pk=self.order.pk, state=expected).update(state=state):
+                raise OrderStateConflict()
+            event = OrderEvent.objects.create(
+                order=self.order, restaurant_id=self.order.restaurant_id,
+                from_state=expected, to_state=state, actor=self.actor,
+            )
+        self.order.state = state
+        return event
@@ -0,0 +1,95 @@
+import json
+from datetime import timedelta
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .broker import get_broker
+from .models import Order, OrderEvent
+from .serializers import OrderEventSerializer, OrderListSerializer
+
+
+# Live order events for restaurant dashboards. Every OrderEvent is published to its
+# restaurant's channel once the transaction that wrote it commits. A new order is sent with
+# the full order, as the order list shows it; a status change only names the order and its
+# states. Event ids double as SSE ids, so a client that reconnects with Last-Event-ID is
+# caught up from the event log before it gets live events again. A payload too big for the
+# broker is sent as ``{'id': ..., 'reload': True}`` and the stream loads it from the log.
+
+REPLAY_WINDOW = timedelta(hours=1)
+REPLAY_LIMIT = 500
+
+# Browsers' EventSource cannot send an Authorization header, so dashboards open the stream
+# with a signed token in the query string instead. It only opens the stream, and lasts a shift
+# because EventSource reconnects with the same URL.
+STREAM_TOKEN_SALT = 'order.stream'
+STREAM_TOKEN_MAX_AGE = 12 * 60 * 60
+
+
+def restaurant_channel(restaurant_id) -> str:
+    return f'restaurant:{restaurant_id}:orders'
+
+
+def stream_token(user) -> str:
+    return signing.dumps(user.pk, salt=STREAM_TOKEN_SALT)
+
+
+def stream_token_user_id(token):
+    """The user id signed into ``token``; raises ``signing.BadSignature`` if invalid or expired."""
+    return signing.loads(token, salt=STREAM_TOKEN_SALT, max_age=STREAM_TOKEN_MAX_AGE)
+
+
+def event_payloads(events) -> list:
+    """Stream payloads for ``events``, with their new orders loaded in one pass."""
+    new_order_ids = [event.order_id for event in events if not event.from_state]
+    orders = Order.objects.select_related('user__customer_profile').prefetch_related(
+        'order_items__item'
+    ).in_bulk(new_order_ids) if new_order_ids else {}
+
+    payloads = []
+    for event in events:
+        payload = dict(OrderEventSerializer(event).data)
+        if event.from_state:
+            payload['type'] = 'order.status_changed'
+        else:
+            payload['type'] = 'order.created'
+            payload['order'] = OrderListSerializer(orders[event.order_id]).data
+        payloads.append(payload)
+    return payloads
+
+
+def replay_events(restaurant_id, last_event_id) -> list:
+    """Payloads of the events a client missed after ``last_event_id``, oldest first."""
+    events = OrderEvent.objects.filter(
+        restaurant_id=restaurant_id,
+        created_at__gte=timezone.now() - REPLAY_WINDOW,
+        pk__gt=last_event_id,
+    ).order_by('pk')[:REPLAY_LIMIT]
+    return event_payloads(list(events))
+
+
+def load_event(restaurant_id, event_id):
+    """Payload of one event of the restaurant, or ``None`` if it is not in the log."""
+    events = list(OrderEvent.objects.filter(restaurant_id=restaurant_id, pk=event_id))
+    return event_payloads(events)[0] if events else None
+
+
+def publish_event(event):
+    broker, channel = get_broker(), restaurant_channel(event.restaurant_id)
+    # Building a payload costs queries; skip it when no dashboard of this restaurant is listening.
+    if not broker.subscriber_count(channel):
+        return
+    payload, = event_payloads([event])
+    limit = getattr(broker, 'MAX_MESSAGE_BYTES', None)
+    if limit and len(json.dumps(payload, cls=DjangoJSONEncoder).encode()) > limit:
+        payload = {'id': event.pk, 'reload': True}
+    broker.publish(channel, payload)
+
+
+@receiver(post_save, sender=OrderEvent)
+def publish_on_commit(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_event(instance))
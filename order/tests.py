@@ -1,9 +1,23 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from restaurant.models import RestaurantProfile
-from .models import Order
+from customer.models import CustomerProfile
+from restaurant.models import RestaurantProfile, Item
+from .models import Order, OrderEvent, OrderItem
+from .services import OrderLifecycle, OrderStateConflict
+from .broker import InProcessBroker, SubscriptionOverflow, get_broker
+from .streaming import publish_event, restaurant_channel
+from .views import RestaurantOrderStreamView
 
 User = get_user_model()
 
@@ -40,13 +54,84 @@ class TestRestaurantOrderListView(APITestCase):
     def test_get_orders_success(self):
         response = self.client.get("/api/restaurant/orders")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  
+        self.assertEqual(len(response.data["results"]), 2)  
 
     def test_get_orders_no_orders(self):
         Order.objects.all().delete()  
         response = self.client.get("/api/restaurant/orders")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0) 
+        self.assertEqual(len(response.data["results"]), 0) 
+
+    def test_get_orders_newest_first_in_pages(self):
+        for i in range(4):
+            Order.objects.create(user=self.manager, restaurant=self.restaurant, total_price=i)
+        # Orders placed in the same instant still page deterministically.
+        Order.objects.update(order_date=self.order1.order_date)
+        expected = list(Order.objects.order_by("-order_id").values_list("order_id", flat=True))
+
+        seen, url = [], "/api/restaurant/orders?page_size=4"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [order["order_id"] for order in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, expected)
+
+    def test_orders_sharing_a_timestamp_beyond_the_offset_cutoff_are_paged_once_each(self):
+        # DRF's CursorPagination skips ties with an offset that gives up after 1000 rows.
+        Order.objects.bulk_create(
+            Order(user=self.manager, restaurant=self.restaurant, total_price=1, order_date=self.order1.order_date)
+            for _ in range(1100)
+        )
+        Order.objects.update(order_date=self.order1.order_date)
+        # Microseconds survive the cursor.
+        Order.objects.filter(pk=self.order2.pk).update(order_date=self.order1.order_date + timedelta(microseconds=1))
+        expected = list(Order.objects.order_by("-order_date", "-order_id").values_list("order_id", flat=True))
+
+        seen, url = [], "/api/restaurant/orders?page_size=100"
+        for _ in range(15):
+            if url is None:
+                break
+            response = self.client.get(url)
+            seen += [order["order_id"] for order in response.data["results"]]
+            url = response.data["next"]
+        self.assertIsNone(url)
+        self.assertEqual(seen, expected)
+
+    def test_get_orders_filtered_by_state_and_date(self):
+        Order.objects.filter(pk=self.order1.pk).update(order_date=self.order1.order_date - timedelta(days=3))
+        response = self.client.get("/api/restaurant/orders?state=pending,preparing")
+        self.assertEqual({order["order_id"] for order in response.data["results"]}, {self.order1.pk, self.order2.pk})
+
+        response = self.client.get("/api/restaurant/orders?state=preparing")
+        self.assertEqual([order["order_id"] for order in response.data["results"]], [self.order2.pk])
+
+        today = timezone.localdate()
+        response = self.client.get(f"/api/restaurant/orders?date_from={today}&date_to={today}")
+        self.assertEqual([order["order_id"] for order in response.data["results"]], [self.order2.pk])
+
+        response = self.client.get(f"/api/restaurant/orders?date_to={today - timedelta(days=1)}")
+        self.assertEqual([order["order_id"] for order in response.data["results"]], [self.order1.pk])
+
+    def test_get_orders_invalid_filters(self):
+        self.assertEqual(self.client.get("/api/restaurant/orders?state=lost").status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/restaurant/orders?date_from=2024-02-01&date_to=2024-01-01")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_orders_query_count_does_not_grow_with_the_page(self):
+        customer = User.objects.create_user(phone_number="5553330005", password="x", role="customer")
+        CustomerProfile.objects.create(user=customer, address="Queue Street")
+        item = Item.objects.create(name="Stew", price=5, restaurant=self.restaurant)
+        for i in range(20):
+            order = Order.objects.create(user=customer, restaurant=self.restaurant, total_price=5)
+            OrderItem.objects.create(order=order, item=item, count=1, price=5)
+
+        # The page of orders with their customers, then the order items with their menu items.
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/restaurant/orders")
+        self.assertEqual(len(response.data["results"]), 22)
+        self.assertEqual(response.data["results"][0]["address"], "Queue Street")
+        self.assertEqual(response.data["results"][0]["order_items"][0]["name"], "Stew")
 
 
 class TestUpdateOrderStatusView(APITestCase):
@@ -70,7 +155,7 @@ class TestUpdateOrderStatusView(APITestCase):
         )
 
         self.valid_payload = {
-            "state": "completed"
+            "state": "preparing"
         }
         self.invalid_payload = {
             "state": "invalid_state"  
@@ -80,11 +165,239 @@ class TestUpdateOrderStatusView(APITestCase):
         response = self.client.patch(f"/api/restaurant/orders/{self.order.order_id}/status", data=self.valid_payload)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.order.refresh_from_db()  
-        self.assertEqual(self.order.state, "completed")  
+        self.assertEqual(self.order.state, "preparing")  
+
+        event = OrderEvent.objects.get(order=self.order)
+        self.assertEqual((event.from_state, event.to_state), ("pending", "preparing"))
+        self.assertEqual(event.actor, self.manager)
 
     def test_update_order_status_invalid_payload(self):
         response = self.client.patch(f"/api/restaurant/orders/{self.order.order_id}/status", data=self.invalid_payload)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.order.refresh_from_db()
-        self.assertEqual(self.order.state, "pending")  
+        self.assertEqual(self.order.state, "pending")
+
+    def test_update_order_status_rejects_skipped_and_backward_moves(self):
+        url = f"/api/restaurant/orders/{self.order.order_id}/status"
+        response = self.client.patch(url, data={"state": "completed"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        for state in ("preparing", "delivering", "completed"):
+            self.assertEqual(self.client.patch(url, data={"state": state}).status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, data={"state": "pending"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, "completed")
+        self.assertEqual(
+            list(self.order.events.values_list("to_state", flat=True)), ["preparing", "delivering", "completed"]
+        )
+
+    def test_update_order_status_requires_a_state(self):
+        response = self.client.patch(f"/api/restaurant/orders/{self.order.order_id}/status", data={})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_events_are_listed_oldest_first(self):
+        OrderLifecycle(self.order).record_placed()
+        OrderLifecycle(self.order, actor=self.manager).transition("preparing")
+        response = self.client.get(f"/api/restaurant/orders/{self.order.order_id}/events")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(event["from_state"], event["to_state"]) for event in response.data],
+            [("", "pending"), ("pending", "preparing")],
+        )
+
+    def test_order_events_of_another_restaurant(self):
+        other_manager = User.objects.create_user(
+            phone_number="5553330001", password="manager_password", role="restaurant_manager"
+        )
+        RestaurantProfile.objects.create(manager=other_manager, name="Other Restaurant")
+        self.client.force_authenticate(user=other_manager)
+        response = self.client.get(f"/api/restaurant/orders/{self.order.order_id}/events")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestOrderLifecycle(TestCase):
+    def setUp(self):
+        manager = User.objects.create_user(phone_number="5553330002", password="x", role="restaurant_manager")
+        restaurant = RestaurantProfile.objects.create(manager=manager, name="Lifecycle Restaurant")
+        self.order = Order.objects.create(user=manager, restaurant=restaurant, total_price=10)
+
+    def test_every_state_has_transitions(self):
+        self.assertEqual(set(OrderLifecycle.TRANSITIONS), {state for state, _ in Order.STATE_CHOICES})
+
+    def test_stale_transition_is_a_conflict(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        OrderLifecycle(self.order).transition("preparing")
+
+        with self.assertRaises(OrderStateConflict):
+            OrderLifecycle(stale).transition("preparing")
+        self.assertEqual(self.order.events.count(), 1)
+
+    def test_events_are_append_only(self):
+        event = OrderLifecycle(self.order).transition("preparing")
+        event.to_state = "completed"
+        with self.assertRaises(ValueError):
+            event.save()
+
+
+class TestInProcessBroker(SimpleTestCase):
+    async def test_publish_from_another_thread(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe("orders")
+        thread = threading.Thread(target=broker.publish, args=("orders", {"id": 1}))
+        thread.start()
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {"id": 1})
+        thread.join()
+
+        broker.publish("other", {"id": 2})
+        subscription.close()
+        broker.publish("orders", {"id": 3})
+        self.assertEqual(broker.subscriber_count("orders"), 0)
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_slow_subscriber_is_dropped(self):
+        broker = InProcessBroker()
+        broker.MAX_QUEUED = 2
+        subscription = broker.subscribe("orders")
+        for i in range(3):
+            broker.publish("orders", {"id": i})
+        await asyncio.sleep(0)
+        with self.assertRaises(SubscriptionOverflow):
+            await subscription.get()
+
+
+class TestRestaurantOrderStreamView(TestCase):
+    url = "/api/restaurant/orders/stream"
+
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5553330003", password="manager_password", role="restaurant_manager"
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=self.manager, name="Live Restaurant")
+        self.order = Order.objects.create(user=self.manager, restaurant=self.restaurant, total_price=10)
+        self.placed = OrderLifecycle(self.order).record_placed()
+        self.token = str(RefreshToken.for_user(self.manager).access_token)
+
+    def test_events_are_published_after_commit(self):
+        channel = restaurant_channel(self.restaurant.pk)
+        listening = mock.patch.object(get_broker(), "subscriber_count", return_value=1)
+        with listening, mock.patch.object(get_broker(), "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                OrderLifecycle(self.order).transition("preparing")
+                publish.assert_not_called()
+        (published_channel, payload), _ = publish.call_args
+        self.assertEqual(published_channel, channel)
+        self.assertEqual(payload["type"], "order.status_changed")
+        self.assertEqual((payload["order"], payload["to_state"]), (self.order.pk, "preparing"))
+
+        with listening, mock.patch.object(get_broker(), "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                order = Order.objects.create(user=self.manager, restaurant=self.restaurant, total_price=20)
+                OrderLifecycle(order).record_placed()
+        payload = publish.call_args[0][1]
+        self.assertEqual(payload["type"], "order.created")
+        self.assertEqual(payload["order"]["order_id"], order.pk)
+
+    def test_nothing_is_built_without_subscribers(self):
+        with mock.patch.object(get_broker(), "publish") as publish:
+            with self.captureOnCommitCallbacks() as callbacks:
+                OrderLifecycle(self.order).transition("preparing")
+            with self.assertNumQueries(0):
+                for callback in callbacks:
+                    callback()
+        publish.assert_not_called()
+
+    async def test_stream_catches_up_then_pushes_live_events(self):
+        with mock.patch.object(RestaurantOrderStreamView, "MAX_STREAM_SECONDS", 1):
+            response = await self.async_client.get(
+                self.url, headers={"Authorization": f"Bearer {self.token}", "Last-Event-ID": str(self.placed.pk - 1)}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            chunks = aiter(response.streaming_content)
+
+            self.assertTrue((await anext(chunks)).startswith(b"retry:"))
+            replayed = (await anext(chunks)).decode()
+            self.assertIn(f"id: {self.placed.pk}\nevent: order.created\n", replayed)
+
+            event = await sync_to_async(OrderLifecycle(self.order).transition)("preparing")
+            get_broker().publish(restaurant_channel(self.restaurant.pk), {"id": self.placed.pk, "type": "duplicate"})
+            await sync_to_async(publish_event)(event)
+            live = (await anext(chunks)).decode()
+            self.assertTrue(live.startswith(f"id: {event.pk}\nevent: order.status_changed\n"))
+            data = json.loads(live.split("data: ", 1)[1])
+            self.assertEqual(data["to_state"], "preparing")
+
+            rest = [chunk async for chunk in chunks]
+        self.assertTrue(all(chunk == b": keepalive\n\n" for chunk in rest))
+        self.assertEqual(get_broker().subscriber_count(restaurant_channel(self.restaurant.pk)), 0)
+
+    async def test_live_events_committed_out_of_id_order_are_all_sent(self):
+        channel = restaurant_channel(self.restaurant.pk)
+        with mock.patch.object(RestaurantOrderStreamView, "MAX_STREAM_SECONDS", 1):
+            response = await self.async_client.get(self.url, headers={"Authorization": f"Bearer {self.token}"})
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+
+            # The later insert commits first.
+            get_broker().publish(channel, {"id": self.placed.pk + 2, "type": "order.status_changed"})
+            get_broker().publish(channel, {"id": self.placed.pk + 1, "type": "order.status_changed"})
+            first, second = (await anext(chunks)).decode(), (await anext(chunks)).decode()
+            [chunk async for chunk in chunks]
+        self.assertTrue(first.startswith(f"id: {self.placed.pk + 2}\n"))
+        self.assertTrue(second.startswith(f"id: {self.placed.pk + 1}\n"))
+
+    async def test_payloads_too_big_for_the_broker_are_loaded_by_the_stream(self):
+        broker = get_broker()
+        with mock.patch.object(RestaurantOrderStreamView, "MAX_STREAM_SECONDS", 1):
+            response = await self.async_client.get(self.url, headers={"Authorization": f"Bearer {self.token}"})
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+
+            with mock.patch.object(broker, "MAX_MESSAGE_BYTES", 10, create=True), \
+                    mock.patch.object(broker, "publish", wraps=broker.publish) as publish:
+                event = await sync_to_async(OrderLifecycle(self.order).transition)("preparing")
+                await sync_to_async(publish_event)(event)
+            self.assertEqual(publish.call_args[0][1], {"id": event.pk, "reload": True})
+
+            live = (await anext(chunks)).decode()
+            [chunk async for chunk in chunks]
+        self.assertTrue(live.startswith(f"id: {event.pk}\nevent: order.status_changed\n"))
+
+    async def test_dropped_subscriptions_end_the_stream(self):
+        with mock.patch.object(RestaurantOrderStreamView, "MAX_STREAM_SECONDS", 60):
+            response = await self.async_client.get(self.url, headers={"Authorization": f"Bearer {self.token}"})
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+            get_broker().drop_all()
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(anext(chunks), 5)
+
+    async def test_browsers_open_the_stream_with_a_stream_token(self):
+        issued = await self.async_client.post(
+            "/api/restaurant/orders/stream/token", headers={"Authorization": f"Bearer {self.token}"}
+        )
+        self.assertEqual(issued.status_code, 200)
+        with mock.patch.object(RestaurantOrderStreamView, "MAX_STREAM_SECONDS", 0):
+            response = await self.async_client.get(self.url, {"token": issued.json()["token"]})
+            self.assertEqual(response.status_code, 200)
+            [chunk async for chunk in response.streaming_content]
+
+        response = await self.async_client.get(self.url, {"token": issued.json()["token"] + "x"})
+        self.assertEqual(response.status_code, 401)
+        # Signed for another purpose.
+        response = await self.async_client.get(self.url, {"token": signing.dumps(self.manager.pk)})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_requires_a_restaurant_manager(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+        customer = await sync_to_async(User.objects.create_user)(
+            phone_number="5553330004", password="customer_password", role="customer"
+        )
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(customer).access_token))()
+        response = await self.async_client.get(self.url, headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 403)
 
@@ -1,4 +1,14 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework import generics
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
@@ -7,20 +17,52 @@ from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from restaurant.permissions import IsRestaurantManager
 from .models import Order
-from .serializers import OrderListSerializer, OrderStatusUpdateSerializer
-from .services import RestaurantOrderService, RestaurantResolver
+from .pagination import RestaurantOrderPagination
+from .serializers import OrderEventSerializer, OrderListFilterSerializer, OrderListSerializer, OrderStatusUpdateSerializer
+from .services import OrderLifecycle, RestaurantOrderService, RestaurantResolver
+from .broker import SubscriptionOverflow, get_broker
+from .streaming import STREAM_TOKEN_MAX_AGE, load_event, replay_events, restaurant_channel, stream_token, \
+    stream_token_user_id
 
 class RestaurantOrderListView(generics.ListAPIView):
     serializer_class = OrderListSerializer
     permission_classes = [IsAuthenticated, IsRestaurantManager]
+    pagination_class = RestaurantOrderPagination
+
+    def get_queryset(self):
+        filters = OrderListFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        restaurant = RestaurantResolver(self.request.user).get_restaurant()
+        return RestaurantOrderService(restaurant).list_orders(
+            states=filters.validated_data.get('state'),
+            date_from=filters.validated_data.get('date_from'),
+            date_to=filters.validated_data.get('date_to'),
+        )
 
     @swagger_auto_schema(
-        operation_summary="Get all orders for a restaurant",
+        operation_summary="Get the orders of a restaurant, newest first",
+        query_serializer=OrderListFilterSerializer,
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Cursor taken from `next`/`previous`.",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description="Orders per page (at most 200).",
+                              type=openapi.TYPE_INTEGER),
+        ],
         responses={
             200: openapi.Response(
-                description="List of orders",
-                schema=OrderListSerializer(many=True)
+                description="A page of orders",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'next': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'previous': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'results': openapi.Schema(
+                            type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)
+                        ),
+                    },
+                ),
             ),
+            400: openapi.Response(description="Invalid filter"),
             401: "Unauthorized",
             403: "Forbidden",
             404: openapi.Response(description="Restaurant not found"),
@@ -28,27 +70,23 @@ class RestaurantOrderListView(generics.ListAPIView):
         }    
     )
     def get(self, request, *args, **kwargs):
-        restaurant = RestaurantResolver(request.user).get_restaurant()
-        orders = RestaurantOrderService(restaurant).list_orders()
-
-        if not orders.exists():
-            return Response([], status=status.HTTP_200_OK)
-
-        serializer = OrderListSerializer(orders, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list(request, *args, **kwargs)
 
 class UpdateOrderStatusView(APIView):
     permission_classes = [IsAuthenticated, IsRestaurantManager]
 
     @swagger_auto_schema(
         operation_summary="Update the status of a specific order",
+        operation_description="Orders move forward only: pending → preparing → ready_for_pickup or delivering → completed "
+                              "(a ready_for_pickup order may also go out for delivery). Each change is logged as an order event.",
         request_body=OrderStatusUpdateSerializer,
         responses={
             200: openapi.Response('Order status updated successfully', OrderStatusUpdateSerializer),
-            400: openapi.Response('Invalid input'),
+            400: openapi.Response('Invalid input or transition not allowed'),
             401: "Unauthorized",
             403: "Forbidden",
             404: openapi.Response('Order not found'),
+            409: openapi.Response('The order was changed by another request'),
             500: openapi.Response("Internal server error"),
         },
     )
@@ -56,8 +94,149 @@ class UpdateOrderStatusView(APIView):
         restaurant = RestaurantResolver(request.user).get_restaurant()
         order = RestaurantOrderService(restaurant).get_order_by_id(kwargs['id'])
 
-        serializer = OrderStatusUpdateSerializer(order, data=request.data, partial=True)
+        serializer = OrderStatusUpdateSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            OrderLifecycle(order, actor=request.user).transition(serializer.validated_data['state'])
             return Response({'message': 'Order status updated successfully'}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class OrderEventListView(generics.ListAPIView):
+    serializer_class = OrderEventSerializer
+    permission_classes = [IsAuthenticated, IsRestaurantManager]
+
+    def get_queryset(self):
+        restaurant = RestaurantResolver(self.request.user).get_restaurant()
+        order = RestaurantOrderService(restaurant).get_order_by_id(self.kwargs['id'])
+        return order.events.all()
+
+    @swagger_auto_schema(
+        operation_summary="Get the state history of an order",
+        responses={
+            200: openapi.Response(
+                description="Order events, oldest first",
+                schema=OrderEventSerializer(many=True)
+            ),
+            401: "Unauthorized",
+            403: "Forbidden",
+            404: openapi.Response('Order not found'),
+            500: openapi.Response("Internal server error"),
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+class OrderStreamTokenView(APIView):
+    permission_classes = [IsAuthenticated, IsRestaurantManager]
+
+    @swagger_auto_schema(
+        operation_summary="Get a token for opening the live order stream",
+        operation_description="Browsers' EventSource cannot send the Authorization header: open "
+                              "`orders/stream?token=<token>` instead. Fetch a new token when the stream "
+                              "fails with 401.",
+        responses={
+            200: openapi.Response(
+                description="Stream token",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'token': openapi.Schema(type=openapi.TYPE_STRING),
+                        'expires_in': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    },
+                ),
+            ),
+            401: "Unauthorized",
+            403: "Forbidden",
+        },
+    )
+    def post(self, request, *args, **kwargs):
+        return Response({'token': stream_token(request.user), 'expires_in': STREAM_TOKEN_MAX_AGE})
+
+
+class RestaurantOrderStreamView(View):
+    """
+    Server-Sent Events stream of the manager's new orders and order status changes, replacing
+    polling of the order list. Browser dashboards get a token from ``orders/stream/token`` and
+    open ``new EventSource('orders/stream?token=...')``; other clients may send the usual
+    ``Authorization: Bearer`` header instead. Streams end after ``MAX_STREAM_SECONDS``; clients
+    reconnect with ``Last-Event-ID`` and get the events they missed first. Needs an ASGI
+    server: under WSGI a stream would hold a worker for its whole lifetime.
+    """
+    KEEPALIVE_SECONDS = 15
+    MAX_STREAM_SECONDS = 5 * 60
+    RETRY_MILLISECONDS = 1000
+
+    async def get(self, request):
+        try:
+            restaurant = await sync_to_async(self.get_restaurant)(request)
+        except APIException as exc:
+            return JsonResponse({'detail': str(exc.detail)}, status=exc.status_code)
+
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+        response = StreamingHttpResponse(self.stream(restaurant.pk, last_event_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def get_restaurant(self, request):
+        user = self.authenticate(request)
+        if user.role != "restaurant_manager":
+            raise PermissionDenied()
+        return RestaurantResolver(user).get_restaurant()
+
+    @staticmethod
+    def authenticate(request):
+        token = request.GET.get('token')
+        if token is None:
+            authenticated = JWTAuthentication().authenticate(request)
+            if authenticated is None:
+                raise NotAuthenticated()
+            return authenticated[0]
+        try:
+            user_id = stream_token_user_id(token)
+        except signing.BadSignature:
+            raise AuthenticationFailed('Stream token is invalid or expired.')
+        user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('Stream token is invalid or expired.')
+        return user
+
+    async def stream(self, restaurant_id, last_event_id):
+        # Subscribe before reading the log, so nothing committed in between is lost; events
+        # that arrive both ways are skipped by id. Live events are otherwise sent as they come:
+        # ids are assigned at insert but published at commit, so they may arrive out of order.
+        subscription = get_broker().subscribe(restaurant_channel(restaurant_id))
+        try:
+            yield f'retry: {self.RETRY_MILLISECONDS}\n\n'
+            replayed = set()
+            if last_event_id is not None:
+                for payload in await sync_to_async(replay_events)(restaurant_id, last_event_id):
+                    replayed.add(payload['id'])
+                    yield self.format_event(payload)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.MAX_STREAM_SECONDS
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    payload = await asyncio.wait_for(subscription.get(), min(self.KEEPALIVE_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                except SubscriptionOverflow:
+                    # Too slow to keep up; the client reconnects and catches up from the log.
+                    return
+                if payload['id'] in replayed:
+                    continue
+                if payload.get('reload'):
+                    payload = await sync_to_async(load_event)(restaurant_id, payload['id'])
+                    if payload is None:
+                        continue
+                yield self.format_event(payload)
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def format_event(payload) -> str:
+        data = json.dumps(payload, cls=DjangoJSONEncoder)
+        return f"id: {payload['id']}\nevent: {payload['type']}\ndata: {data}\n\n"
+
@@ -30,7 +30,7 @@ class RestaurantProfileAdmin(admin.ModelAdmin):
         return readonly_fields + ('display_score',)
 
     def display_score(self, obj):
-        return obj.calculate_score()
+        return obj.score
 
     display_score.short_description = 'Score'
 
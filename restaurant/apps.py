@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RestaurantConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restaurant'
+
+    def ready(self):
+        # Imported for their signal receivers.
+        from . import autocomplete, menu, photos, schedule, search_cache, thumbnails, trigram  # noqa: F401
+        from .search import install_search_indexes
+        post_migrate.connect(install_search_indexes, sender=self)
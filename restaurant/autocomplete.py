@@ -0,0 +1,191 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RestaurantProfile, Item
+
+
+# In-process prefix index for the search box. Every word of a name is a key in a sorted list
+# per kind, so a prefix lookup is a binary search plus a forward scan that stops after
+# ``limit`` matches, and never touches the database. The index is built lazily on first use
+# and patched by the save/delete receivers below.
+#
+# Each worker process holds its own copy. Committed writes bump a version number in the
+# default cache; a process compares it with the version its index was built from at most
+# every VERSION_CHECK_SECONDS and rebuilds in the background when they differ, serving the
+# old index meanwhile. That only reaches other processes when CACHE_URL points at a shared
+# cache, so every index is also rebuilt once it is MAX_AGE_SECONDS old. The same catches
+# writes that bypass signals (bulk_create, queryset.update()).
+
+RESTAURANT = 'restaurant'
+ITEM = 'item'
+KINDS = (RESTAURANT, ITEM)
+
+
+def normalize(text: str) -> str:
+    return ' '.join((text or '').casefold().split())
+
+
+class SuggestionIndex:
+    VERSION_KEY = 'restaurant:suggestions:version'
+    VERSION_CHECK_SECONDS = 5
+    MAX_AGE_SECONDS = 10 * 60
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rebuilding = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._keys = {kind: [] for kind in KINDS}
+            self._entries = {}
+            self._built = False
+            self._version = None
+            self._built_at = self._checked_at = 0.0
+
+    def build(self):
+        """Rebuild from the database. Readers keep using the previous index until it is swapped in."""
+        version = cache.get_or_set(self.VERSION_KEY, 0, timeout=None)
+        keys, entries = {kind: [] for kind in KINDS}, {}
+        restaurants = RestaurantProfile.objects.filter(state='approved').values_list('id', 'name')
+        for restaurant_id, name in restaurants.iterator(chunk_size=2000):
+            keys[RESTAURANT].extend(self._entry(entries, RESTAURANT, restaurant_id, name, None))
+        items = Item.objects.filter(state='available').values_list('item_id', 'name', 'restaurant_id')
+        for item_id, name, restaurant_id in items.iterator(chunk_size=2000):
+            keys[ITEM].extend(self._entry(entries, ITEM, item_id, name, restaurant_id))
+        for kind_keys in keys.values():
+            kind_keys.sort()
+
+        with self._lock:
+            self._keys, self._entries, self._built = keys, entries, True
+            self._version = version
+            self._built_at = self._checked_at = time.monotonic()
+
+    def update(self, kind, obj_id, name, restaurant_id=None, visible=True):
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(kind, obj_id)
+            if visible:
+                for key in self._entry(self._entries, kind, obj_id, name, restaurant_id):
+                    insort(self._keys[kind], key)
+
+    def remove(self, kind, obj_id):
+        self.update(kind, obj_id, None, visible=False)
+
+    def mark_changed(self):
+        """Tell the other processes that the indexed names changed. Call it after commit."""
+        cache.add(self.VERSION_KEY, 0, timeout=None)
+        try:
+            version = cache.incr(self.VERSION_KEY)
+        except ValueError:
+            # Evicted in between; every index reads as stale and is rebuilt.
+            return
+        with self._lock:
+            # This process already applied its own change; anything else means it missed one.
+            self._version = version if self._version == version - 1 else None
+
+    def suggest(self, prefix: str, limit: int) -> dict:
+        """Return up to ``limit`` restaurant and item suggestions whose name has a word starting with ``prefix``."""
+        prefix = normalize(prefix)
+        results = {kind: {} for kind in KINDS}
+        if not prefix:
+            return results
+
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.build()
+        else:
+            self._refresh_if_stale()
+
+        with self._lock:
+            for kind in KINDS:
+                keys, matches = self._keys[kind], results[kind]
+                position = bisect_left(keys, (prefix,))
+                while position < len(keys) and len(matches) < limit:
+                    key, obj_id = keys[position]
+                    if not key.startswith(prefix):
+                        break
+                    if obj_id not in matches:
+                        matches[obj_id] = self._entries[(kind, obj_id)]
+                    position += 1
+        return results
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.VERSION_CHECK_SECONDS:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._checked_at = now
+            stale = now - self._built_at >= self.MAX_AGE_SECONDS or cache.get(self.VERSION_KEY) != self._version
+            if not stale:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_rebuild, name='suggestion-index', daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+            connections.close_all()
+
+    @staticmethod
+    def _entry(entries, kind, obj_id, name, restaurant_id):
+        """Record the entry in ``entries`` and return its keys, for the caller to insert."""
+        words = normalize(name).split(' ')
+        # One key per word suffix, so "napoli pizzeria" is found by "nap" and by "pizz".
+        keys = [(' '.join(words[i:]), obj_id) for i in range(len(words)) if words[i]]
+        entries[(kind, obj_id)] = (name, restaurant_id, keys)
+        return keys
+
+    def _remove(self, kind, obj_id):
+        entry = self._entries.pop((kind, obj_id), None)
+        if entry is None:
+            return
+        keys = self._keys[kind]
+        for key in entry[2]:
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+
+suggestion_index = SuggestionIndex()
+
+
+def _changed():
+    transaction.on_commit(suggestion_index.mark_changed)
+
+
+@receiver(post_save, sender=RestaurantProfile)
+def index_restaurant(sender, instance, **kwargs):
+    suggestion_index.update(RESTAURANT, instance.pk, instance.name, visible=instance.state == 'approved')
+    _changed()
+
+
+@receiver(post_delete, sender=RestaurantProfile)
+def unindex_restaurant(sender, instance, **kwargs):
+    suggestion_index.remove(RESTAURANT, instance.pk)
+    _changed()
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, **kwargs):
+    suggestion_index.update(
+        ITEM, instance.pk, instance.name, instance.restaurant_id, visible=instance.state == 'available'
+    )
+    _changed()
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    suggestion_index.remove(ITEM, instance.pk)
+    _changed()
@@ -0,0 +1,51 @@
+import os
+from io import BytesIO
+from PIL import Image, ImageOps
+
+
+# Pure Pillow helpers for photo thumbnails. This module must not import Django: it is loaded
+# by the worker processes of the thumbnail pool, which are started without settings.
+
+# Longest side in pixels per variant; the aspect ratio is kept.
+THUMBNAIL_SIZES = {
+    'small': 160,
+    'medium': 480,
+}
+# File extension -> Pillow format and save options.
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(name: str, size: str, extension: str) -> str:
+    """Storage name of a variant, next to the original: ``item_images/ab12.png`` -> ``item_images/ab12_small.webp``."""
+    root, _ = os.path.splitext(name)
+    return f'{root}_{size}.{extension}'
+
+
+def render_thumbnails(source: bytes) -> dict:
+    """Return ``{(size, extension): bytes}`` for every configured variant of the image in ``source``."""
+    variants = {}
+    with Image.open(BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        for size, pixels in THUMBNAIL_SIZES.items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((pixels, pixels), Image.LANCZOS)
+            for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+                output = BytesIO()
+                _for_format(thumbnail, image_format).save(output, image_format, **options)
+                variants[(size, extension)] = output.getvalue()
+    return variants
+
+
+def _for_format(image, image_format):
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if image_format == 'WEBP' and has_alpha:
+        return image.convert('RGBA')
+    if has_alpha:
+        # JPEG has no alpha channel: flatten transparent areas onto white.
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+        return background
+    return image.convert('RGB')
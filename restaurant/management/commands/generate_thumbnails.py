@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.models import RestaurantProfile, Item
+from restaurant.thumbnails import has_thumbnails, save_thumbnails, thumbnail_pool
+
+
+class Command(BaseCommand):
+    help = "Generate the resized variants of existing restaurant and item photos."
+    CHUNK_SIZE = 32
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that already exist.")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (RestaurantProfile, Item):
+            photos = model.objects.exclude(photo='').exclude(photo__isnull=True).values_list('photo', flat=True)
+            names.update(photos.iterator())
+        if not options['force']:
+            names = {name for name in names if not has_thumbnails(name)}
+
+        names, failed = sorted(names), 0
+        # Bounded batches, so at most CHUNK_SIZE originals are held in memory at once.
+        for start in range(0, len(names), self.CHUNK_SIZE):
+            futures = {name: thumbnail_pool.render(name) for name in names[start:start + self.CHUNK_SIZE]}
+            for name, future in futures.items():
+                try:
+                    save_thumbnails(name, future.result())
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{name}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Generated thumbnails for {len(names) - failed} photos."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.models import RestaurantProfile
+from restaurant.schedule import sync_opening_intervals
+
+
+class Command(BaseCommand):
+    help = "Regenerate the weekly opening intervals of every restaurant from its opening hours."
+
+    def handle(self, *args, **options):
+        count = 0
+        for restaurant in RestaurantProfile.objects.only('id', 'open_hour', 'close_hour').iterator(chunk_size=500):
+            sync_opening_intervals(restaurant)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt opening intervals for {count} restaurants."))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from restaurant.menu import bump_menu_version, menu_cache
+from restaurant.models import RestaurantProfile, Item
+from restaurant.services import ScoreCalculator
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored review aggregates of every restaurant and item from the review table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Number of rows rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        restaurants = self._rebuild(RestaurantProfile, ScoreCalculator.restaurant_review_totals, chunk_size)
+        items = self._rebuild(Item, ScoreCalculator.item_review_totals, chunk_size)
+        bump_menu_version(RestaurantProfile.objects.all())
+        menu_cache.invalidate(*RestaurantProfile.objects.values_list('pk', flat=True))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt scores for {restaurants} restaurants and {items} items."))
+
+    def _rebuild(self, model, totals_for, chunk_size):
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            totals = totals_for(chunk)
+            with transaction.atomic():
+                objs = list(model.objects.select_for_update().filter(pk__in=chunk))
+                for obj in objs:
+                    obj.review_sum, obj.review_count = totals.get(obj.pk, (0, 0))
+                    obj.score = ScoreCalculator.average(obj.review_sum, obj.review_count)
+                model.objects.bulk_update(objs, ['review_sum', 'review_count', 'score'])
+        return len(pks)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from restaurant.search_cache import search_cache
+
+
+class Command(BaseCommand):
+    help = "Show the hit/miss counters of the restaurant search response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        if not search_cache.shared:
+            self.stderr.write(self.style.WARNING(
+                "The search cache is local memory, so these counters only cover this command's own process. "
+                "Set SEARCH_CACHE_URL to a shared backend, or read them from the server at "
+                "GET /api/restaurant/search-cache/stats."
+            ))
+        stats = search_cache.stats()
+        self.stdout.write(f"hits={stats['hits']} misses={stats['misses']} hit_ratio={stats['hit_ratio']}")
+        if options['reset']:
+            search_cache.reset_stats()
@@ -0,0 +1,23 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from restaurant.menu import menu_cache
+from restaurant.models import RestaurantProfile
+
+
+class Command(BaseCommand):
+    help = "Pre-render the public menu of every approved restaurant into the menu cache."
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], LocMemCache):
+            self.stderr.write(self.style.WARNING(
+                "The default cache is local memory, so the menus are only rendered into this command's own "
+                "process and the servers render them on first request. Set CACHE_URL to a shared backend."
+            ))
+        restaurant_ids = RestaurantProfile.objects.filter(state='approved').order_by('pk').values_list('pk', flat=True)
+        count = 0
+        for restaurant_id in restaurant_ids.iterator():
+            menu_cache.rebuild(restaurant_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Pre-rendered the menus of {count} restaurants."))
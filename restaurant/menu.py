@@ -0,0 +1,162 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils.cache import quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from order.models import Review
+from .models import RestaurantProfile, Item
+from .serializers import ItemSerializer
+from .thumbnails import thumbnails_stored
+
+
+# Every restaurant carries a menu version that changes whenever anything shown on its menu
+# changes: an item is created, edited or deleted, or a review moves item scores. The public
+# menu is served with an ETag built from it, so a client that already has the current menu
+# revalidates without a full menu render.
+#
+# The rendered menu itself is cached as ready-to-send JSON bytes, one entry per restaurant
+# holding the whole list and every single item. A hit costs one indexed lookup of the menu
+# version and no serializer: a render built from an older version is re-rendered, so a change
+# made by another process (a worker, rebuild_scores, generate_thumbnails) is served at once even
+# when the cache is local to each process. Item writes drop the entry at once; writes made by the restaurant manager through the
+# item views re-render it after commit, and review score changes re-render it on a background
+# worker while the previous entry keeps being served. A render is only cached while the menu
+# version it was built from is still current. Freshly stored thumbnails count as a menu
+# change too: until then the menu links the original photos.
+
+
+def bump_menu_version(restaurants):
+    """Mark the menus of ``restaurants`` (a queryset) as changed."""
+    restaurants.update(menu_version=F('menu_version') + 1)
+
+
+def get_menu_version(restaurant_id):
+    """Return the current menu version, or ``None`` when the restaurant does not exist."""
+    return RestaurantProfile.objects.filter(pk=restaurant_id).values_list('menu_version', flat=True).first()
+
+
+def menu_etag(restaurant_id, version) -> str:
+    return quote_etag(f'menu-{restaurant_id}-{version}')
+
+
+RenderedMenu = namedtuple('RenderedMenu', ['version', 'menu', 'items'])
+
+
+class MenuCache:
+    TIMEOUT = 60 * 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='menu-render')
+
+    def get(self, restaurant_id):
+        """Return the current ``RenderedMenu``, rendering it when needed; ``None`` if the restaurant does not exist."""
+        version = get_menu_version(restaurant_id)
+        rendered = cache.get(self._key(restaurant_id)) if version is not None else None
+        if rendered is not None and rendered.version == version:
+            return rendered
+        return self.rebuild(restaurant_id, version)
+
+    def rebuild(self, restaurant_id, version=None):
+        if version is None:
+            version = get_menu_version(restaurant_id)
+        if version is None:
+            self.invalidate(restaurant_id)
+            return None
+
+        renderer = JSONRenderer()
+        data = ItemSerializer(Item.objects.filter(restaurant_id=restaurant_id), many=True).data
+        rendered = RenderedMenu(
+            version=version,
+            menu=renderer.render(data),
+            items={item['item_id']: renderer.render(item) for item in data},
+        )
+        cache.set(self._key(restaurant_id), rendered, self.TIMEOUT)
+        # An edit that committed while rendering has already dropped the entry, so this write
+        # brought the old menu back: drop it again. An edit committing after this check drops
+        # the entry itself.
+        if get_menu_version(restaurant_id) != version:
+            self.invalidate(restaurant_id)
+        return rendered
+
+    def rebuild_on_commit(self, restaurant_id):
+        transaction.on_commit(lambda: self.rebuild(restaurant_id))
+
+    def rebuild_in_background(self, restaurant_id):
+        # A burst of reviews for one restaurant collapses into a single pending render.
+        with self._lock:
+            if restaurant_id in self._pending:
+                return
+            self._pending.add(restaurant_id)
+        self._executor.submit(self._background_rebuild, restaurant_id)
+
+    def invalidate(self, *restaurant_ids):
+        cache.delete_many([self._key(restaurant_id) for restaurant_id in restaurant_ids])
+
+    def _background_rebuild(self, restaurant_id):
+        with self._lock:
+            self._pending.discard(restaurant_id)
+        try:
+            self.rebuild(restaurant_id)
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def _key(restaurant_id):
+        return f'restaurant:menu:{restaurant_id}'
+
+
+menu_cache = MenuCache()
+
+
+def _invalidate_menu(restaurant_id):
+    # Dropped again at commit, in case a concurrent read re-cached the old menu in between.
+    menu_cache.invalidate(restaurant_id)
+    transaction.on_commit(lambda: menu_cache.invalidate(restaurant_id))
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, instance, **kwargs):
+    bump_menu_version(RestaurantProfile.objects.filter(pk=instance.restaurant_id))
+    _invalidate_menu(instance.restaurant_id)
+
+
+@receiver(thumbnails_stored)
+def item_thumbnails_stored(sender, name, **kwargs):
+    restaurant_ids = list(
+        RestaurantProfile.objects.filter(items__photo=name).values_list('pk', flat=True).distinct()
+    )
+    if restaurant_ids:
+        bump_menu_version(RestaurantProfile.objects.filter(pk__in=restaurant_ids))
+        menu_cache.invalidate(*restaurant_ids)
+
+
+@receiver(post_delete, sender=RestaurantProfile)
+def restaurant_deleted(sender, instance, **kwargs):
+    _invalidate_menu(instance.pk)
+
+
+def _scores_changed(order_id):
+    restaurants = RestaurantProfile.objects.filter(order__order_id=order_id)
+    bump_menu_version(restaurants)
+    for restaurant_id in restaurants.values_list('pk', flat=True):
+        transaction.on_commit(lambda restaurant_id=restaurant_id: menu_cache.rebuild_in_background(restaurant_id))
+
+
+@receiver(post_save, sender=Review)
+def review_created(sender, instance, created, **kwargs):
+    if created:
+        _scores_changed(instance.order_id)
+
+
+@receiver(pre_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    _scores_changed(instance.order_id)
@@ -0,0 +1,110 @@
+from django.db import transaction
+
+from .autocomplete import suggestion_index, ITEM
+from .menu import bump_menu_version, menu_cache
+from .models import RestaurantProfile, Item
+from .search_cache import search_cache
+from .serializers import ItemImportSerializer
+from .trigram import TRIGRAM_INDEXES
+
+
+# Bulk import of a restaurant's menu. Rows are matched to existing items by ``item_id`` or,
+# failing that, by case-insensitive name; unmatched rows become new items. Every row is
+# validated before anything is written, and the import is all-or-nothing: one bulk INSERT and
+# one bulk UPDATE in a single transaction. bulk_create/bulk_update send no model signals, so
+# the in-process indexes and caches those signals normally maintain are refreshed here.
+
+BATCH_SIZE = 500
+
+
+def _match_key(name):
+    return ' '.join((name or '').casefold().split())
+
+
+class MenuImporter:
+    def __init__(self, restaurant):
+        self.restaurant = restaurant
+        self.errors = []
+        self.created = []
+        self.updated = []
+
+    def run(self, rows) -> bool:
+        """Import ``rows`` (a list of dicts); return ``False`` and fill ``errors`` if any row is invalid."""
+        with transaction.atomic():
+            existing = list(Item.objects.select_for_update().filter(restaurant=self.restaurant))
+            by_id = {item.pk: item for item in existing}
+            by_name = {}
+            for item in existing:
+                by_name.setdefault(_match_key(item.name), []).append(item)
+
+            update_fields = set()
+            claimed = {}
+            for row_number, row in enumerate(rows, start=1):
+                if not isinstance(row, dict):
+                    self.errors.append({'row': row_number, 'errors': {'non_field_errors': ["Expected an object."]}})
+                    continue
+                item = self._match(row, by_id, by_name, row_number)
+                if item is False:
+                    continue
+
+                serializer = ItemImportSerializer(item, data=row, partial=item is not None)
+                if not serializer.is_valid():
+                    self.errors.append({'row': row_number, 'errors': serializer.errors})
+                    continue
+
+                data = serializer.validated_data
+                data.pop('item_id', None)
+                key = item.pk if item is not None else _match_key(data['name'])
+                if key in claimed:
+                    self._error(row_number, f"Same item as row {claimed[key]}.")
+                    continue
+                claimed[key] = row_number
+
+                if item is None:
+                    self.created.append(Item(restaurant=self.restaurant, **data))
+                else:
+                    for field, value in data.items():
+                        setattr(item, field, value)
+                    update_fields.update(data)
+                    self.updated.append(item)
+
+            if self.errors:
+                return False
+
+            Item.objects.bulk_create(self.created, batch_size=BATCH_SIZE)
+            if self.updated and update_fields:
+                Item.objects.bulk_update(self.updated, sorted(update_fields), batch_size=BATCH_SIZE)
+            bump_menu_version(RestaurantProfile.objects.filter(pk=self.restaurant.pk))
+            transaction.on_commit(self._refresh_indexes)
+        return True
+
+    def _match(self, row, by_id, by_name, row_number):
+        """Return the existing item a row refers to, ``None`` for a new item, ``False`` on error."""
+        if row.get('item_id') not in (None, ''):
+            try:
+                item = by_id.get(int(row['item_id']))
+            except (TypeError, ValueError):
+                item = None
+            if item is None:
+                self._error(row_number, "No item with this item_id on your menu.", field='item_id')
+                return False
+            return item
+
+        matches = by_name.get(_match_key(row.get('name')), [])
+        if len(matches) > 1:
+            self._error(row_number, "Several items on your menu have this name; use item_id.", field='name')
+            return False
+        return matches[0] if matches else None
+
+    def _error(self, row_number, message, field='non_field_errors'):
+        self.errors.append({'row': row_number, 'errors': {field: [message]}})
+
+    def _refresh_indexes(self):
+        for item in self.created + self.updated:
+            TRIGRAM_INDEXES[Item].update(item.pk, item.name)
+            suggestion_index.update(
+                ITEM, item.pk, item.name, item.restaurant_id, visible=item.state == 'available'
+            )
+        suggestion_index.mark_changed()
+        search_cache.invalidate()
+        menu_cache.rebuild(self.restaurant.pk)
@@ -3,14 +3,20 @@ import uuid
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from order.models import Review
 from user.models import User
 from .services import ScoreCalculator
+from .storage import photo_storage
+
+
+MAX_PHOTO_SIZE_MB = 2
 
 
 def validate_photo_size(value):
-    max_size_mb = 2
-    if value.size > max_size_mb * 1024 * 1024:
-        raise ValidationError(f"Photo size must not exceed {max_size_mb}MB.")
+    if value.size > MAX_PHOTO_SIZE_MB * 1024 * 1024:
+        raise ValidationError(f"Photo size must not exceed {MAX_PHOTO_SIZE_MB}MB.")
         
 class RestaurantProfile(models.Model):
     def unique_image_path(instance, filename):
@@ -41,6 +47,9 @@ class RestaurantProfile(models.Model):
     business_type = models.CharField(max_length=255, choices=BUSINESS_TYPES, default='restaurant')  
     city_name = models.CharField(max_length=255)  
     score = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
+    review_count = models.PositiveIntegerField(default=0)
+    review_sum = models.PositiveIntegerField(default=0)
+    menu_version = models.PositiveIntegerField(default=0)
     delivery_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     address = models.TextField(blank=True, null=True) 
     description = models.TextField(blank=True, null=True)
@@ -52,6 +61,8 @@ class RestaurantProfile(models.Model):
     
     photo = models.ImageField(
         upload_to=unique_image_path,
+        storage=photo_storage,
+        max_length=255,
         blank=True,
         null=True,
         validators=[
@@ -59,6 +70,11 @@ class RestaurantProfile(models.Model):
             validate_photo_size]
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='restaurant_location_idx'),
+        ]
+
     def calculate_score(self):
         return ScoreCalculator.calculate_restaurant_score(self)
 
@@ -82,10 +98,14 @@ class Item(models.Model):
     discount = models.PositiveIntegerField(default=0, help_text="Discount percentage (0 to 100)")
     name = models.CharField(max_length=100)
     score = models.FloatField(default=0.0)
+    review_count = models.PositiveIntegerField(default=0)
+    review_sum = models.PositiveIntegerField(default=0)
     description = models.TextField(null=True, blank=True)
     state = models.CharField(max_length=50, choices=STATE_CHOICES, default='available')
     photo = models.ImageField(
         upload_to=unique_item_image_path,
+        storage=photo_storage,
+        max_length=255,
         blank=True,
         null=True,
         validators=[
@@ -99,3 +119,46 @@ class Item(models.Model):
     def __str__(self):
         return self.name
 
+
+class StoredPhoto(models.Model):
+    """Reference count of a content-addressed photo file, shared by every row that points at it."""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
+class OpeningInterval(models.Model):
+    """A weekly opening span in local minutes since Monday 00:00; ``end_minute`` is exclusive."""
+    restaurant = models.ForeignKey(RestaurantProfile, on_delete=models.CASCADE, related_name='opening_intervals')
+    start_minute = models.PositiveIntegerField()
+    end_minute = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_minute', 'end_minute'], name='opening_interval_idx'),
+        ]
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_scores(sender, instance, created, **kwargs):
+    if created:
+        ScoreCalculator.apply_review(
+            RestaurantProfile.objects.filter(order__order_id=instance.order_id), instance.score
+        )
+        ScoreCalculator.apply_review(
+            Item.objects.filter(order_items__order_id=instance.order_id), instance.score
+        )
+
+
+@receiver(pre_delete, sender=Review)
+def remove_review_from_scores(sender, instance, **kwargs):
+    # pre_delete rather than post_delete: when the review goes away with its order,
+    # the order's items may already be deleted by the time post_delete fires.
+    ScoreCalculator.apply_review(
+        RestaurantProfile.objects.filter(order__order_id=instance.order_id), instance.score, count=-1
+    )
+    ScoreCalculator.apply_review(
+        Item.objects.filter(order_items__order_id=instance.order_id), instance.score, count=-1
+    )
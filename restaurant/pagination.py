@@ -0,0 +1,136 @@
+import json
+from base64 import b64decode, b64encode
+from datetime import date, datetime
+from decimal import Decimal
+from functools import reduce
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over ``ordering``, which must end with a unique field.
+
+    The cursor holds the values of every ordering field of the last row sent, and the next page
+    is the rows strictly after that tuple, e.g. ``rank < r OR (rank = r AND pk > p)``. Unlike
+    DRF's CursorPagination, which positions on the first field and skips ties with a capped
+    offset, this stays correct however many rows share a rank, a distance or a timestamp.
+    Dates, datetimes and decimals travel in the cursor as strings and are parsed back by the
+    model field they are compared with.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    ordering = ()
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        self.position = position
+
+        ordering = [self._flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Paged past the end: go back from where the cursor pointed.
+            return self.encode_cursor(self.position, reverse=True)
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError(position)
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = json.dumps(cursor, separators=(',', ':'), default=self._encode_value)
+        encoded = b64encode(encoded.encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def _position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    @staticmethod
+    def _encode_value(value):
+        # Full precision: DjangoJSONEncoder would cut microseconds and break timestamp ties.
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError(f'Cannot put {type(value).__name__} in a cursor')
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(ordering, position):
+        """Rows that sort strictly after ``position`` in ``ordering``."""
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {other.lstrip('-'): value for other, value in zip(ordering[:index], position)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+
+class SearchResultsPagination(KeysetPagination):
+    """
+    One result list of ``RestaurantListView``. Restaurants and items are paged independently,
+    so every list reads its own ``<name>_cursor`` query parameter.
+    """
+
+    def __init__(self, name, ordering):
+        self.cursor_query_param = f'{name}_cursor'
+        self.ordering = ordering
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .imaging import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, variant_name
+from .models import RestaurantProfile, Item, StoredPhoto
+from .storage import photo_storage
+
+
+# Reference counting for content-addressed photos. Identical uploads share one file, so a file
+# (and its thumbnails) may only be deleted once no restaurant or item points at it anymore.
+# Each instance remembers the photo it was loaded with; saves that change the photo move one
+# reference from the old file to the new one, deletes drop one. Files stored before
+# content addressing have no counter and are never deleted, as before.
+
+
+def acquire_photo(name):
+    if not name:
+        return
+    stored, _ = StoredPhoto.objects.get_or_create(name=name)
+    StoredPhoto.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release_photo(name):
+    if not name:
+        return
+    with transaction.atomic():
+        stored = StoredPhoto.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            return
+        if stored.ref_count > 1:
+            StoredPhoto.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') - 1)
+            return
+        stored.delete()
+        transaction.on_commit(lambda: _delete_files(name))
+
+
+def _delete_files(name):
+    # Someone may have stored the same content again since the last reference went away.
+    if StoredPhoto.objects.filter(name=name).exists():
+        return
+    photo_storage.delete(name)
+    for size in THUMBNAIL_SIZES:
+        for extension in THUMBNAIL_FORMATS:
+            photo_storage.delete(variant_name(name, size, extension))
+
+
+def _photo_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=RestaurantProfile)
+@receiver(post_init, sender=Item)
+def remember_photo(sender, instance, **kwargs):
+    # Read the raw attribute: going through the descriptor would load a deferred field.
+    instance._stored_photo = _photo_name(instance.__dict__.get('photo'))
+
+
+@receiver(post_save, sender=RestaurantProfile)
+@receiver(post_save, sender=Item)
+def count_photo_references(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'photo' not in update_fields:
+        return
+    previous = '' if created else getattr(instance, '_stored_photo', '')
+    current = _photo_name(instance.photo)
+    if current != previous:
+        acquire_photo(current)
+        release_photo(previous)
+        instance._stored_photo = current
+
+
+@receiver(post_delete, sender=RestaurantProfile)
+@receiver(post_delete, sender=Item)
+def drop_photo_reference(sender, instance, **kwargs):
+    release_photo(getattr(instance, '_stored_photo', ''))
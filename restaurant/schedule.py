@@ -0,0 +1,72 @@
+from datetime import time
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_time
+
+from .models import RestaurantProfile, OpeningInterval
+
+
+# Opening hours are stored as weekly minute intervals so that "open at time T" is an indexed
+# range lookup, and spans past midnight (e.g. 18:00-02:00) are just intervals into the next day.
+# The open filter of the restaurant listing is a subquery on that index, so the SQL stays the
+# same size however many restaurants are open.
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(moment=None) -> int:
+    local = timezone.localtime(moment or timezone.now())
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+def weekly_intervals(open_hour, close_hour) -> list:
+    """Return ``(start_minute, end_minute)`` pairs for a restaurant open every day between the two hours."""
+    open_hour, close_hour = _as_time(open_hour), _as_time(close_hour)
+    opens = open_hour.hour * 60 + open_hour.minute
+    closes = close_hour.hour * 60 + close_hour.minute
+    if opens == closes:
+        return [(0, MINUTES_PER_WEEK)]
+
+    length = (closes - opens) % MINUTES_PER_DAY
+    intervals = []
+    for day in range(7):
+        start = day * MINUTES_PER_DAY + opens
+        end = start + length
+        if end <= MINUTES_PER_WEEK:
+            intervals.append((start, end))
+        else:
+            # Sunday night running into Monday morning wraps around the week.
+            intervals.append((start, MINUTES_PER_WEEK))
+            intervals.append((0, end - MINUTES_PER_WEEK))
+    return intervals
+
+
+def sync_opening_intervals(restaurant):
+    intervals = weekly_intervals(restaurant.open_hour, restaurant.close_hour)
+    with transaction.atomic():
+        OpeningInterval.objects.filter(restaurant=restaurant).delete()
+        OpeningInterval.objects.bulk_create(
+            OpeningInterval(restaurant=restaurant, start_minute=start, end_minute=end) for start, end in intervals
+        )
+
+
+def open_now_filter(moment=None) -> Q:
+    """Filter for the restaurants open at ``moment`` (now by default), as a subquery on the intervals."""
+    minute = minute_of_week(moment)
+    open_ids = OpeningInterval.objects.filter(start_minute__lte=minute, end_minute__gt=minute)
+    return Q(pk__in=open_ids.values('restaurant_id'))
+
+
+def _as_time(value) -> time:
+    return parse_time(value) if isinstance(value, str) else value
+
+
+@receiver(post_save, sender=RestaurantProfile)
+def update_opening_intervals(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {'open_hour', 'close_hour'} & set(update_fields):
+        return
+    sync_opening_intervals(instance)
@@ -0,0 +1,217 @@
+import re
+from abc import ABC, abstractmethod
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import BooleanField, Case, Count, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import RestaurantProfile, Item
+from .trigram import FUZZY_THRESHOLD, MAX_CANDIDATES, TRIGRAM_INDEXES
+
+
+# Full-text search over the name and description of restaurants and items.
+# Each database vendor gets its own backend: PostgreSQL uses an expression GIN index over a
+# tsvector, SQLite an FTS5 external-content table kept in sync by triggers. Both are installed
+# after migrate and stay in sync on every write, including bulk ones. Other vendors fall back
+# to substring matching.
+# Typo-tolerant matching on names is a second, fuzzy mode: pg_trgm word similarity behind a
+# trigram GIN index on PostgreSQL, and an in-process trigram inverted index elsewhere.
+
+SEARCH_FIELDS = ('name', 'description')
+SEARCH_MODELS = (RestaurantProfile, Item)
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(query: str) -> list:
+    return TOKEN_RE.findall(query.lower())
+
+
+def no_results(queryset):
+    """An empty result that still carries ``search_rank``, so callers can order by it."""
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+
+class SearchBackend(ABC):
+    """Strategy interface for ranked full-text search over ``SEARCH_FIELDS``."""
+
+    def install(self, connection):
+        """Create the index structures used by this backend. Must be idempotent."""
+
+    @abstractmethod
+    def search(self, queryset, query: str):
+        """Return ``queryset`` filtered to ``query``, annotated with ``search_rank`` and ordered by it."""
+        raise NotImplementedError
+
+    # Matches are checked against the caller's queryset this many at a time, best first.
+    FUZZY_BATCH_SIZE = 500
+
+    def fuzzy_search(self, queryset, query: str):
+        """Like ``search`` but matches misspelled names; ``search_rank`` is the trigram similarity."""
+        matches = list(TRIGRAM_INDEXES[queryset.model].search(query).items())
+        # The index knows nothing about the queryset's filters, so keep the best matches that
+        # pass them; capping first would let ineligible rows crowd out the eligible ones.
+        scores = {}
+        for start in range(0, len(matches), self.FUZZY_BATCH_SIZE):
+            batch = matches[start:start + self.FUZZY_BATCH_SIZE]
+            eligible = set(queryset.filter(pk__in=[pk for pk, _ in batch]).values_list('pk', flat=True))
+            scores.update((pk, score) for pk, score in batch if pk in eligible)
+            if len(scores) >= MAX_CANDIDATES:
+                break
+        scores = dict(list(scores.items())[:MAX_CANDIDATES])
+        if not scores:
+            return no_results(queryset)
+        return queryset.filter(pk__in=scores).annotate(
+            search_rank=Case(
+                *(When(pk=pk, then=Value(score)) for pk, score in scores.items()),
+                output_field=FloatField(),
+            )
+        ).order_by('-search_rank', 'pk')
+
+
+class PostgresSearchBackend(SearchBackend):
+    # The query repeats the exact index expression, so the planner can use the GIN index.
+    DOCUMENT = "to_tsvector('simple', coalesce({name}, '') || ' ' || coalesce({description}, ''))"
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for model in SEARCH_MODELS:
+                table = model._meta.db_table
+                document = self.DOCUMENT.format(name='name', description='description')
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS "{table}_search_idx" ON "{table}" USING gin ({document})')
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{table}_name_trgm_idx" ON "{table}" USING gin (name gin_trgm_ops)'
+                )
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return no_results(queryset)
+
+        table = queryset.model._meta.db_table
+        document = self.DOCUMENT.format(name=f'"{table}"."name"', description=f'"{table}"."description"')
+        ts_query = ' & '.join(f'{token}:*' for token in tokens)
+        # ts_rank() and word_similarity() return real. Ranks are cast to double precision, as
+        # Python floats are, so a rank carried in a pagination cursor compares equal to itself.
+        return queryset.filter(
+            RawSQL(f"{document} @@ to_tsquery('simple', %s)", (ts_query,), output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(
+                f"ts_rank({document}, to_tsquery('simple', %s))::float8", (ts_query,), output_field=FloatField()
+            )
+        ).order_by('-search_rank', 'pk')
+
+    def fuzzy_search(self, queryset, query):
+        query = ' '.join(query.split())
+        if not query:
+            return no_results(queryset)
+
+        name = f'"{queryset.model._meta.db_table}"."name"'
+        # "<%" is answered from the trigram index using pg_trgm.word_similarity_threshold
+        # (0.6 by default); the explicit bound keeps the threshold in line with FUZZY_THRESHOLD.
+        return queryset.filter(
+            RawSQL(f"%s <%% {name}", (query,), output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f"word_similarity(%s, {name})::float8", (query,), output_field=FloatField())
+        ).filter(
+            search_rank__gte=FUZZY_THRESHOLD
+        ).order_by('-search_rank', 'pk')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Local fallback backed by an FTS5 shadow table per model."""
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            for model in SEARCH_MODELS:
+                table = model._meta.db_table
+                fts, pk = f'{table}_fts', model._meta.pk.column
+                columns = ', '.join(SEARCH_FIELDS)
+                new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+                old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+                exists = fts in connection.introspection.table_names(cursor)
+
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{table}', "
+                    f"content_rowid='{pk}', tokenize='unicode61 remove_diacritics 2')"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.{pk}, {new_values}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.{pk}, {old_values}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.{pk}, {old_values}); "
+                    f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.{pk}, {new_values}); END"
+                )
+                if not exists:
+                    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return no_results(queryset)
+
+        model = queryset.model
+        table, pk = model._meta.db_table, model._meta.pk.column
+        fts = f'{table}_fts'
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (match,))
+        ).annotate(
+            # bm25() is lower for better matches; negate it so every backend sorts descending.
+            search_rank=RawSQL(
+                f'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = "{table}"."{pk}"',
+                (match,),
+                output_field=FloatField(),
+            )
+        ).order_by('-search_rank', 'pk')
+
+
+class SubstringSearchBackend(SearchBackend):
+
+    def search(self, queryset, query):
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition).annotate(search_rank=Value(1.0, output_field=FloatField()))
+
+
+def facet_counts(queryset, open_now, business_type_filter=Q(), open_filter=Q()) -> dict:
+    """
+    Count restaurants per business type and open now with a single conditional aggregate.
+    Each facet applies the other facet's filter but not its own, so a count tells the client
+    how many results it would get by picking that value. ``open_now`` is the open-now filter.
+    """
+    aggregates = {
+        value: Count('pk', filter=Q(business_type=value) & open_filter)
+        for value, _ in RestaurantProfile.BUSINESS_TYPES
+    }
+    aggregates['open_now'] = Count('pk', filter=open_now & business_type_filter)
+    counts = queryset.order_by().aggregate(**aggregates)
+    return {
+        'business_type': {value: counts[value] for value, _ in RestaurantProfile.BUSINESS_TYPES},
+        'open_now': counts['open_now'],
+    }
+
+
+SEARCH_BACKENDS = {
+    "postgresql": PostgresSearchBackend(),
+    "sqlite": SQLiteSearchBackend(),
+}
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS) -> SearchBackend:
+    return SEARCH_BACKENDS.get(connections[using].vendor, SubstringSearchBackend())
+
+
+def install_search_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate handler that installs the search index of the active database."""
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if all(model._meta.db_table in tables for model in SEARCH_MODELS):
+        get_search_backend(using).install(connection)
@@ -0,0 +1,88 @@
+import hashlib
+import time
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RestaurantProfile, Item
+from .thumbnails import thumbnails_stored
+
+
+# Response cache for the public restaurant/item search. Keys are built from the normalized
+# search parameters and the current minute (the open-now filter changes every minute).
+# Every key also carries a generation number kept in the cache itself; any restaurant or
+# item write, and any newly stored thumbnails, bump it, which orphans all cached responses at
+# once on every process. Orphaned entries are evicted by the backend's TTL/LRU. Hit and miss counters live next to them, so
+# they cover every process only when the alias is a shared backend; with the default local
+# memory they count the process that reads them, which is why the serving process exposes
+# them at an admin endpoint (SearchCacheStatsView).
+
+CACHE_ALIAS = 'search'
+KEY_PARAMS = ('query', 'business_type', 'is_open', 'restaurants_cursor', 'items_cursor', 'page_size')
+
+
+def normalize(value) -> str:
+    return ' '.join((value or '').casefold().split())
+
+
+class SearchResponseCache:
+    GENERATION_KEY = 'search:generation'
+    HITS_KEY = 'search:hits'
+    MISSES_KEY = 'search:misses'
+
+    @property
+    def cache(self):
+        return caches[CACHE_ALIAS]
+
+    @property
+    def shared(self) -> bool:
+        """Whether other processes see the same entries and counters."""
+        return not isinstance(self.cache, LocMemCache)
+
+    def key(self, request) -> str:
+        params = [normalize(request.query_params.get(name)) for name in KEY_PARAMS]
+        minute = int(time.time() // 60)
+        generation = self.cache.get_or_set(self.GENERATION_KEY, 0, None)
+        raw = '|'.join([request.get_host(), str(minute), *params])
+        return f'search:{generation}:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self._count(self.MISSES_KEY if data is None else self.HITS_KEY)
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data)
+
+    def invalidate(self):
+        self._count(self.GENERATION_KEY)
+
+    def stats(self) -> dict:
+        counters = self.cache.get_many([self.HITS_KEY, self.MISSES_KEY])
+        hits, misses = counters.get(self.HITS_KEY, 0), counters.get(self.MISSES_KEY, 0)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else 0.0}
+
+    def reset_stats(self):
+        self.cache.delete_many([self.HITS_KEY, self.MISSES_KEY])
+
+    def _count(self, key):
+        # add() is a no-op when the counter exists; incr() is atomic on shared backends.
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
+
+
+search_cache = SearchResponseCache()
+
+
+@receiver(post_save, sender=RestaurantProfile)
+@receiver(post_delete, sender=RestaurantProfile)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(thumbnails_stored)
+def invalidate_search_cache(sender, **kwargs):
+    search_cache.invalidate()
@@ -1,33 +1,91 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import RestaurantProfile, Item
+from .services import ScoreCalculator
+from .thumbnails import thumbnail_urls
 
-class RestaurantProfileSerializer(serializers.ModelSerializer):
+
+class ScoredListSerializer(serializers.ListSerializer):
+    """
+    Resolves the live scores of a whole page with one grouped aggregate and hands them to
+    the child serializer, instead of letting every child run its own aggregate.
+    Only used when ``USE_STORED_SCORES`` is off; otherwise children read the stored score.
+    """
+
+    def to_representation(self, data):
+        if settings.USE_STORED_SCORES:
+            return super().to_representation(data)
+
+        objs = list(data.all() if hasattr(data, 'all') else data)
+        totals = self.child.review_totals([obj.pk for obj in objs])
+        self.child.batch_scores = {pk: ScoreCalculator.average(*total) for pk, total in totals.items()}
+        try:
+            return super().to_representation(objs)
+        finally:
+            self.child.batch_scores = None
+
+
+class ScoreFieldMixin:
+    batch_scores = None
+
+    def get_score(self, obj):
+        if self.batch_scores is not None:
+            return self.batch_scores.get(obj.pk, 0.0)
+        if settings.USE_STORED_SCORES:
+            return float(obj.score)
+        return obj.calculate_score()
+
+
+class RestaurantProfileSerializer(ScoreFieldMixin, serializers.ModelSerializer):
     score = serializers.SerializerMethodField()
+    # Only present when the queryset was annotated by GeoLocator.within_radius.
+    distance = serializers.FloatField(read_only=True)
+    thumbnails = serializers.SerializerMethodField()
+    review_totals = staticmethod(ScoreCalculator.restaurant_review_totals)
 
     class Meta:
         model = RestaurantProfile
         fields = [
             'id', 'name', 'business_type', 'city_name', 'score','delivery_price', 'address',
-            'description', 'open_hour', 'close_hour', 'latitude', 'longitude', 'photo'
+            'description', 'open_hour', 'close_hour', 'latitude', 'longitude', 'photo', 'thumbnails', 'distance'
         ]
+        list_serializer_class = ScoredListSerializer
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj.photo)
 
     def validate_photo(self, value):
         if value and not value.name.lower().endswith(('jpg', 'jpeg', 'png')):
             raise serializers.ValidationError("Photo must be in JPEG or PNG format.")
         return value
 
-    def get_score(self, obj):
-        return obj.calculate_score()
-    
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(ScoreFieldMixin, serializers.ModelSerializer):
     restaurant = serializers.PrimaryKeyRelatedField(read_only=True)
     score = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+    review_totals = staticmethod(ScoreCalculator.item_review_totals)
 
     class Meta:
         model = Item
-        fields = ['item_id', 'restaurant', 'price', 'discount', 'name', 'description', 'state', 'photo', 'score']
+        fields = [
+            'item_id', 'restaurant', 'price', 'discount', 'name', 'description', 'state', 'photo', 'thumbnails', 'score'
+        ]
+        list_serializer_class = ScoredListSerializer
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj.photo)
 
-    def get_score(self, obj):
-        return obj.calculate_score()
 
+class ItemImportSerializer(serializers.ModelSerializer):
+    """One row of a bulk menu import; ``item_id`` is optional and selects the item to update."""
+    item_id = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = Item
+        fields = ['item_id', 'name', 'price', 'discount', 'description', 'state']
+
+    def validate_discount(self, value):
+        if value > 100:
+            raise serializers.ValidationError("Discount must be between 0 and 100.")
+        return value
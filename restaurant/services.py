@@ -1,4 +1,7 @@
-from django.db.models import Avg
+import math
+from collections import defaultdict
+from django.db.models import Avg, Count, F, FloatField, Sum, Value
+from django.db.models.functions import ASin, Cast, Coalesce, Cos, NullIf, Power, Radians, Round, Sin, Sqrt
 
 from order.models import Order, OrderItem, Review
 
@@ -18,3 +21,88 @@ class ScoreCalculator:
         orders = Order.objects.filter(order_id__in=order_items.values_list('order_id', flat=True))
         avg_score = Review.objects.filter(order__in=orders).aggregate(average=Avg('score'))['average']
         return round(avg_score, 2) if avg_score else 0.0
+
+    @staticmethod
+    def restaurant_review_totals(restaurant_ids) -> dict:
+        """Returns ``{restaurant_id: (review_sum, review_count)}`` using one grouped aggregate."""
+        rows = (
+            Review.objects.filter(order__restaurant_id__in=restaurant_ids)
+            .values('order__restaurant_id')
+            .annotate(review_sum=Sum('score'), review_count=Count('id'))
+        )
+        return {row['order__restaurant_id']: (row['review_sum'], row['review_count']) for row in rows}
+
+    @staticmethod
+    def item_review_totals(item_ids) -> dict:
+        """Returns ``{item_id: (review_sum, review_count)}`` using one query."""
+        # An item can appear on several lines of one order; each review still counts once per item.
+        rows = (
+            Review.objects.filter(order__order_items__item_id__in=item_ids)
+            .values_list('order__order_items__item_id', 'id', 'score')
+            .distinct()
+        )
+        totals = defaultdict(lambda: [0, 0])
+        for item_id, _, score in rows:
+            totals[item_id][0] += score
+            totals[item_id][1] += 1
+        return {item_id: tuple(total) for item_id, total in totals.items()}
+
+    @staticmethod
+    def average(review_sum: int, review_count: int) -> float:
+        return round(review_sum / review_count, 2) if review_count else 0.0
+
+    @staticmethod
+    def apply_review(queryset, score: int, count: int = 1) -> int:
+        """
+        Adds (``count=1``) or removes (``count=-1``) a review score to the stored
+        ``review_sum``/``review_count``/``score`` columns of every row in ``queryset``.
+        The average is recomputed inside the same UPDATE, so concurrent reviews never
+        overwrite each other.
+        """
+        review_sum = F('review_sum') + Value(score * count)
+        review_count = F('review_count') + Value(count)
+        average = Round(Cast(review_sum, FloatField()) / NullIf(review_count, Value(0)), 2)
+        return queryset.update(
+            review_sum=review_sum,
+            review_count=review_count,
+            score=Coalesce(average, Value(0.0), output_field=FloatField()),
+        )
+
+
+class GeoLocator:
+    """Distance queries over models with ``latitude``/``longitude`` columns."""
+
+    EARTH_RADIUS_KM = 6371.0
+    KM_PER_DEGREE = 111.32
+
+    @classmethod
+    def bounding_box(cls, latitude: float, longitude: float, radius_km: float) -> dict:
+        """Range lookups for a box that contains the circle; served by the (latitude, longitude) index."""
+        lat_delta = radius_km / cls.KM_PER_DEGREE
+        lookups = {'latitude__range': (latitude - lat_delta, latitude + lat_delta)}
+        cos_latitude = math.cos(math.radians(latitude))
+        if cos_latitude > 0.01:
+            lng_delta = radius_km / (cls.KM_PER_DEGREE * cos_latitude)
+            lookups['longitude__range'] = (longitude - lng_delta, longitude + lng_delta)
+        return lookups
+
+    @classmethod
+    def distance_km(cls, latitude: float, longitude: float):
+        """Haversine distance from the given point, as a database expression."""
+        lat1, lng1 = math.radians(latitude), math.radians(longitude)
+        lat2 = Radians(Cast('latitude', FloatField()))
+        lng2 = Radians(Cast('longitude', FloatField()))
+        a = (
+            Power(Sin((lat2 - Value(lat1)) / Value(2.0)), 2)
+            + Value(math.cos(lat1)) * Cos(lat2) * Power(Sin((lng2 - Value(lng1)) / Value(2.0)), 2)
+        )
+        return Value(2 * cls.EARTH_RADIUS_KM) * ASin(Sqrt(a), output_field=FloatField())
+
+    @classmethod
+    def within_radius(cls, queryset, latitude: float, longitude: float, radius_km: float):
+        """Rows of ``queryset`` within ``radius_km`` of the point, annotated with ``distance`` in km."""
+        return (
+            queryset.filter(**cls.bounding_box(latitude, longitude, radius_km))
+            .annotate(distance=cls.distance_km(latitude, longitude))
+            .filter(distance__lte=radius_km)
+        )
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import posixpath
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, under ``<upload dir>/ab/cd/<sha256><ext>``.
+    The name the model asked for only contributes its directory and extension; saving content
+    that is already stored returns the existing name without writing anything. Deleting is
+    left to the reference counts kept by ``restaurant.photos``.
+
+    A content-addressed name always resolves to itself: it is never truncated or given a
+    random suffix, and two saves of the same content racing each other both end up at it.
+    """
+    # One spelling per format, so the same bytes never get two names.
+    EXTENSION_ALIASES = {'.jpeg': '.jpg'}
+
+    def save(self, name, content, max_length=None):
+        # PhotoUploadHandler hashes uploads while streaming them; anything else is hashed here.
+        digest = getattr(content, 'sha256', None) or self.hash(content)
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        extension = self.EXTENSION_ALIASES.get(extension, extension)
+        name = posixpath.join(directory, digest[:2], digest[2:4], f'{digest}{extension}')
+        if max_length is not None and len(name) > max_length:
+            raise SuspiciousFileOperation(f'"{name}" is longer than the {max_length} characters the field allows.')
+        if self.exists(name):
+            return name
+        # Written under a name of its own and moved into place, so a racing save of the same
+        # content replaces the file with identical bytes instead of picking another name.
+        temporary = super().save(posixpath.join(posixpath.dirname(name), f'{digest}.tmp{extension}'), content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+    def replace(self, name, content):
+        """
+        Store ``content`` under exactly ``name``, overwriting any file there. For files derived
+        from a stored one, such as thumbnails, whose names follow from the original's name.
+        """
+        if self.exists(name):
+            self.delete(name)
+        return super().save(name, content)
+
+    @staticmethod
+    def hash(content) -> str:
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        return sha256.hexdigest()
+
+
+photo_storage = ContentAddressedStorage()
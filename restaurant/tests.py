@@ -1,3 +1,1052 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+from datetime import datetime, time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from PIL import Image
 
-# Create your tests here.
+from order.models import Order, OrderItem, Review
+from customer.models import CustomerProfile
+from .models import RestaurantProfile, Item, OpeningInterval, StoredPhoto
+from .autocomplete import suggestion_index
+from .trigram import MAX_CANDIDATES, TRIGRAM_INDEXES, trigrams
+from .imaging import variant_name
+from .menu import bump_menu_version, menu_cache, menu_etag
+from .search import PostgresSearchBackend, facet_counts
+from .search_cache import search_cache
+from .schedule import MINUTES_PER_WEEK, open_now_filter, weekly_intervals
+from .serializers import RestaurantProfileSerializer, ItemSerializer
+from .thumbnails import generate_thumbnails, has_thumbnails, thumbnail_pool
+from .uploads import PhotoUploadHandler
+
+User = get_user_model()
+
+
+class TestRestaurantScoreAggregates(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5550001111",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.customer = User.objects.create_user(
+            phone_number="5550002222",
+            password="customer_pass",
+            first_name="Customer",
+            role="customer",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=self.manager, name="Score Restaurant")
+
+    def _create_order(self):
+        return Order.objects.create(
+            user=self.customer,
+            restaurant=self.restaurant,
+            total_price=10,
+            state="completed",
+        )
+
+    def test_reviews_update_stored_score(self):
+        Review.objects.create(user=self.customer, order=self._create_order(), score=5)
+        Review.objects.create(user=self.customer, order=self._create_order(), score=4)
+        Review.objects.create(user=self.customer, order=self._create_order(), score=4)
+
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.review_count, 3)
+        self.assertEqual(self.restaurant.review_sum, 13)
+        self.assertEqual(self.restaurant.score, Decimal("4.33"))
+        self.assertEqual(float(self.restaurant.score), self.restaurant.calculate_score())
+
+    def test_deleting_reviews_updates_stored_score(self):
+        review = Review.objects.create(user=self.customer, order=self._create_order(), score=2)
+        Review.objects.create(user=self.customer, order=self._create_order(), score=4)
+
+        review.delete()
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.review_count, 1)
+        self.assertEqual(self.restaurant.score, Decimal("4.00"))
+
+        Order.objects.all().delete()
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.review_count, 0)
+        self.assertEqual(self.restaurant.review_sum, 0)
+        self.assertEqual(self.restaurant.score, Decimal("0.00"))
+
+    def test_serializer_reads_stored_score(self):
+        Review.objects.create(user=self.customer, order=self._create_order(), score=3)
+        self.restaurant.refresh_from_db()
+
+        with self.assertNumQueries(0):
+            data = RestaurantProfileSerializer(self.restaurant).data
+        self.assertEqual(data["score"], 3.0)
+
+
+class TestItemScoreAggregates(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5550003333",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.customer = User.objects.create_user(
+            phone_number="5550004444",
+            password="customer_pass",
+            first_name="Customer",
+            role="customer",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=self.manager, name="Item Score Restaurant")
+        self.pizza = Item.objects.create(restaurant=self.restaurant, name="Pizza", price=10)
+        self.salad = Item.objects.create(restaurant=self.restaurant, name="Salad", price=5)
+
+    def _create_order(self, *items):
+        order = Order.objects.create(user=self.customer, restaurant=self.restaurant, total_price=10)
+        for item in items:
+            OrderItem.objects.create(order=order, item=item, count=1, price=item.price)
+        return order
+
+    def test_review_updates_items_of_the_order(self):
+        Review.objects.create(user=self.customer, order=self._create_order(self.pizza, self.salad), score=5)
+        Review.objects.create(user=self.customer, order=self._create_order(self.pizza, self.pizza), score=2)
+
+        self.pizza.refresh_from_db()
+        self.salad.refresh_from_db()
+        self.assertEqual((self.pizza.review_count, self.pizza.review_sum, self.pizza.score), (2, 7, 3.5))
+        self.assertEqual((self.salad.review_count, self.salad.review_sum, self.salad.score), (1, 5, 5.0))
+        self.assertEqual(self.pizza.score, self.pizza.calculate_score())
+
+        with self.assertNumQueries(0):
+            data = ItemSerializer(self.pizza).data
+        self.assertEqual(data["score"], 3.5)
+
+    def test_deleting_order_removes_its_review_from_items(self):
+        order = self._create_order(self.pizza)
+        Review.objects.create(user=self.customer, order=order, score=4)
+
+        order.delete()
+        self.pizza.refresh_from_db()
+        self.assertEqual((self.pizza.review_count, self.pizza.review_sum, self.pizza.score), (0, 0, 0.0))
+
+    def test_rebuild_scores_command_fixes_drift(self):
+        Review.objects.create(user=self.customer, order=self._create_order(self.pizza, self.salad), score=3)
+        Review.objects.create(user=self.customer, order=self._create_order(self.pizza), score=4)
+        Item.objects.update(review_count=9, review_sum=1, score=0.1)
+        RestaurantProfile.objects.update(review_count=0, review_sum=0, score=0)
+
+        call_command("rebuild_scores", chunk_size=1, stdout=StringIO())
+
+        self.pizza.refresh_from_db()
+        self.salad.refresh_from_db()
+        self.restaurant.refresh_from_db()
+        self.assertEqual((self.pizza.review_count, self.pizza.review_sum, self.pizza.score), (2, 7, 3.5))
+        self.assertEqual((self.salad.review_count, self.salad.review_sum, self.salad.score), (1, 3, 3.0))
+        self.assertEqual((self.restaurant.review_count, self.restaurant.review_sum), (2, 7))
+        self.assertEqual(self.restaurant.score, Decimal("3.50"))
+
+
+@override_settings(USE_STORED_SCORES=False)
+class TestBatchScoreResolution(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5550005555",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.customer = User.objects.create_user(
+            phone_number="5550006666",
+            password="customer_pass",
+            first_name="Customer",
+            role="customer",
+        )
+        self.restaurant = RestaurantProfile.objects.create(
+            manager=self.manager, name="Batch Restaurant", state="approved"
+        )
+        self.url = reverse("menu-items", kwargs={"restaurant_id": self.restaurant.id})
+
+    def _add_reviewed_items(self, count, score):
+        order = Order.objects.create(user=self.customer, restaurant=self.restaurant, total_price=10)
+        for i in range(count):
+            item = Item.objects.create(restaurant=self.restaurant, name=f"Item {i}", price=1)
+            OrderItem.objects.create(order=order, item=item, count=1, price=1)
+        Review.objects.create(user=self.customer, order=order, score=score)
+        # Make sure live scores are being served, not the stored aggregates.
+        Item.objects.update(score=0)
+        RestaurantProfile.objects.update(score=0)
+
+    def test_menu_scores_cost_a_constant_number_of_queries(self):
+        self._add_reviewed_items(3, score=4)
+        # Menu version, items, review scores, and the version re-check before keeping the render.
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual([item["score"] for item in response.json()], [4.0] * 3)
+
+        self._add_reviewed_items(30, score=2)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 33)
+        self.assertEqual(response.json()[-1]["score"], 2.0)
+
+    def test_restaurant_list_uses_batch_scores(self):
+        self._add_reviewed_items(1, score=5)
+        data = RestaurantProfileSerializer(RestaurantProfile.objects.all(), many=True).data
+        self.assertEqual(data[0]["score"], 5.0)
+        self.assertEqual(RestaurantProfileSerializer(self.restaurant).data["score"], 5.0)
+
+
+class TestRestaurantSearch(APITestCase):
+    def setUp(self):
+        managers = [
+            User.objects.create_user(
+                phone_number=f"555001000{i}",
+                password="manager_pass",
+                first_name="Manager",
+                role="restaurant_manager",
+            )
+            for i in range(3)
+        ]
+        self.pizzeria = RestaurantProfile.objects.create(
+            manager=managers[0], name="Napoli Pizzeria", description="Wood fired pizza", state="approved"
+        )
+        self.cafe = RestaurantProfile.objects.create(
+            manager=managers[1], name="Corner Cafe", description="Coffee and a slice of pizza", state="approved"
+        )
+        RestaurantProfile.objects.create(manager=managers[2], name="Pizza Pending", state="pending")
+        self.margherita = Item.objects.create(restaurant=self.pizzeria, name="Margherita Pizza", price=9)
+        self.latte = Item.objects.create(
+            restaurant=self.cafe, name="Latte", description="Espresso with milk", price=3
+        )
+        self.url = reverse("restaurant-profile-list")
+
+    def test_search_ranks_name_and_description_matches(self):
+        response = self.client.get(self.url, {"query": "pizz"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.pizzeria.id, self.cafe.id])
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [self.margherita.item_id])
+
+        response = self.client.get(self.url, {"query": "espresso"})
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [self.latte.item_id])
+        self.assertEqual(response.data["restaurants"], [])
+
+    def test_search_index_follows_writes(self):
+        self.latte.name = "Pizza Latte"
+        self.latte.save()
+        self.margherita.delete()
+
+        response = self.client.get(self.url, {"query": "pizza"})
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [self.latte.item_id])
+
+        Item.objects.filter(pk=self.latte.pk).update(name="Latte")
+        # update() sends no signals, so the response cache has to be invalidated by hand.
+        search_cache.invalidate()
+        response = self.client.get(self.url, {"query": "pizza"})
+        self.assertEqual(response.data["items"], [])
+
+
+class TestRestaurantListPagination(APITestCase):
+    def setUp(self):
+        self.restaurants = [
+            RestaurantProfile.objects.create(
+                manager=User.objects.create_user(
+                    phone_number=f"55502000{i:02d}",
+                    password="manager_pass",
+                    first_name="Manager",
+                    role="restaurant_manager",
+                ),
+                name=f"Burger Place {i}",
+                state="approved",
+            )
+            for i in range(3)
+        ]
+        Item.objects.bulk_create(
+            Item(restaurant=self.restaurants[0], name=f"Burger {i}", price=5) for i in range(60)
+        )
+        self.url = reverse("restaurant-profile-list")
+
+    def _follow(self, url, key):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [obj["item_id" if key == "items" else "id"] for obj in response.data[key]]
+            url = response.data[f"{key}_next"]
+        return ids
+
+    def test_lists_are_paged_with_independent_cursors(self):
+        response = self.client.get(self.url, {"page_size": 2})
+        self.assertEqual(len(response.data["restaurants"]), 2)
+        self.assertEqual(len(response.data["items"]), 2)
+
+        items_next = response.data["items_next"]
+        response = self.client.get(items_next)
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [r.id for r in self.restaurants[:2]])
+        self.assertEqual(len(response.data["items"]), 2)
+        self.assertIsNotNone(response.data["items_previous"])
+        self.assertIsNone(response.data["restaurants_previous"])
+
+        self.assertEqual(len(self._follow(f"{self.url}?page_size=2", "restaurants")), 3)
+        item_ids = self._follow(f"{self.url}?page_size=7&query=burger", "items")
+        self.assertEqual(sorted(item_ids), sorted(Item.objects.values_list("item_id", flat=True)))
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(self.url, {"page_size": 1000})
+        self.assertEqual(len(response.data["items"]), 50)
+        self.assertIsNotNone(response.data["items_next"])
+
+    def test_ties_beyond_the_offset_cutoff_are_paged_once_each(self):
+        # Identical names get identical ranks; DRF's offset-based tie breaking gave up after 1000.
+        Item.objects.bulk_create(
+            Item(restaurant=self.restaurants[1], name="Pizza", price=5) for _ in range(1150)
+        )
+        pizza_ids = sorted(Item.objects.filter(name="Pizza").values_list("item_id", flat=True))
+        item_ids, url = [], f"{self.url}?page_size=50&query=pizza"
+        for _ in range(30):
+            if url is None:
+                break
+            response = self.client.get(url)
+            item_ids += [item["item_id"] for item in response.data["items"]]
+            url = response.data["items_next"]
+        self.assertIsNone(url)
+        self.assertEqual(len(item_ids), len(pizza_ids))
+        self.assertEqual(sorted(item_ids), pizza_ids)
+
+    def test_previous_cursor_returns_the_same_page(self):
+        first = self.client.get(self.url, {"page_size": 7, "query": "burger"})
+        second = self.client.get(first.data["items_next"])
+        back = self.client.get(second.data["items_previous"])
+        self.assertEqual(back.data["items"], first.data["items"])
+        self.assertIsNone(back.data["items_previous"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"items_cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_postgres_ranks_compare_as_double_precision(self):
+        # A real rank never equals the double the cursor carries, which skips or repeats ties.
+        backend = PostgresSearchBackend()
+        for search in (backend.search, backend.fuzzy_search):
+            rank = search(Item.objects.all(), "pizza").query.annotations["search_rank"]
+            self.assertTrue(rank.sql.endswith("::float8"))
+
+
+class TestNearbyRestaurants(APITestCase):
+    def setUp(self):
+        locations = [(35.71, 51.40), (35.70, 51.43), (35.80, 51.40), (None, None)]
+        self.restaurants = []
+        for i, (latitude, longitude) in enumerate(locations):
+            manager = User.objects.create_user(
+                phone_number=f"55503000{i:02d}",
+                password="manager_pass",
+                first_name="Manager",
+                role="restaurant_manager",
+            )
+            self.restaurants.append(RestaurantProfile.objects.create(
+                manager=manager, name=f"Restaurant {i}", state="approved", latitude=latitude, longitude=longitude
+            ))
+        self.far_item = Item.objects.create(restaurant=self.restaurants[2], name="Far Kebab", price=5)
+        self.near_item = Item.objects.create(restaurant=self.restaurants[1], name="Near Kebab", price=5)
+        self.url = reverse("restaurant-profile-list")
+
+    def test_nearby_returns_restaurants_sorted_by_distance(self):
+        response = self.client.get(self.url, {"nearby": "true", "latitude": 35.70, "longitude": 51.40, "radius": 5})
+        self.assertEqual(response.status_code, 200)
+        restaurants = response.data["restaurants"]
+        self.assertEqual([r["id"] for r in restaurants], [self.restaurants[0].id, self.restaurants[1].id])
+        self.assertAlmostEqual(restaurants[0]["distance"], 1.11, places=2)
+        self.assertAlmostEqual(restaurants[1]["distance"], 2.71, places=2)
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [self.near_item.item_id])
+
+        response = self.client.get(self.url, {"nearby": "true", "latitude": 35.70, "longitude": 51.40, "radius": 20})
+        self.assertEqual(len(response.data["restaurants"]), 3)
+        self.assertNotIn("distance", self.client.get(self.url).data["restaurants"][0])
+
+    def test_nearby_defaults_to_customer_location(self):
+        customer = User.objects.create_user(phone_number="5550309999", password="pass", role="customer")
+        CustomerProfile.objects.create(user=customer, latitude=35.80, longitude=51.40)
+        self.client.force_authenticate(user=customer)
+
+        response = self.client.get(self.url, {"nearby": "true", "radius": 1})
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.restaurants[2].id])
+
+    def test_nearby_requires_a_point(self):
+        response = self.client.get(self.url, {"nearby": "true"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {"nearby": "true", "latitude": 35.7, "longitude": 51.4, "radius": 500})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestOpeningSchedule(APITestCase):
+    # 2024-01-01 is a Monday; datetimes are in the project time zone.
+    MONDAY = datetime(2024, 1, 1)
+
+    def setUp(self):
+        cache.clear()
+        self.day = self._create("Day Restaurant", "09:00", "23:00")
+        self.night = self._create("Night Restaurant", "18:00", "02:00")
+        self.url = reverse("restaurant-profile-list")
+
+    def _create(self, name, open_hour, close_hour):
+        manager = User.objects.create_user(
+            phone_number=f"555040{RestaurantProfile.objects.count():04d}",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        return RestaurantProfile.objects.create(
+            manager=manager, name=name, state="approved", open_hour=open_hour, close_hour=close_hour
+        )
+
+    def _at(self, days, hour, minute=0):
+        moment = self.MONDAY.replace(day=1 + days, hour=hour, minute=minute)
+        return timezone.make_aware(moment)
+
+    def _open_ids(self, moment):
+        return set(RestaurantProfile.objects.filter(open_now_filter(moment)).values_list("id", flat=True))
+
+    def test_weekly_intervals_wrap_overnight_spans(self):
+        self.assertEqual(weekly_intervals(time(9), time(23))[0], (540, 1380))
+        intervals = weekly_intervals(time(18), time(2))
+        self.assertEqual(intervals[0], (1080, 1560))
+        self.assertEqual(intervals[-2:], [(9720, MINUTES_PER_WEEK), (0, 120)])
+        self.assertEqual(weekly_intervals(time(0), time(0)), [(0, MINUTES_PER_WEEK)])
+
+    def test_open_restaurants_at_time(self):
+        self.assertEqual(self._open_ids(self._at(0, 12)), {self.day.id})
+        self.assertEqual(self._open_ids(self._at(0, 20)), {self.day.id, self.night.id})
+        self.assertEqual(self._open_ids(self._at(1, 1, 30)), {self.night.id})
+        self.assertEqual(self._open_ids(self._at(0, 1)), {self.night.id})
+        self.assertEqual(self._open_ids(self._at(0, 23, 30)), {self.night.id})
+
+    def test_hours_change_rebuilds_intervals(self):
+        self.day.close_hour = time(23, 45)
+        self.day.save()
+        self.assertEqual(OpeningInterval.objects.filter(restaurant=self.day).count(), 7)
+        self.assertIn(self.day.id, self._open_ids(self._at(2, 23, 30)))
+
+    def test_is_open_filter(self):
+        with mock.patch("restaurant.schedule.timezone.now", return_value=self._at(3, 1)):
+            response = self.client.get(self.url, {"is_open": "true"})
+            self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.night.id])
+            response = self.client.get(self.url, {"is_open": "false"})
+            self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.day.id])
+
+
+class TestAutocomplete(APITestCase):
+    def setUp(self):
+        suggestion_index.reset()
+        managers = [
+            User.objects.create_user(
+                phone_number=f"555050000{i}",
+                password="manager_pass",
+                first_name="Manager",
+                role="restaurant_manager",
+            )
+            for i in range(2)
+        ]
+        self.pizzeria = RestaurantProfile.objects.create(manager=managers[0], name="Napoli Pizzeria", state="approved")
+        RestaurantProfile.objects.create(manager=managers[1], name="Pizza Pending", state="pending")
+        self.pizza = Item.objects.create(restaurant=self.pizzeria, name="Pepperoni Pizza", price=9)
+        Item.objects.create(restaurant=self.pizzeria, name="Pizza Bread", price=3, state="unavailable")
+        self.url = reverse("restaurant-autocomplete")
+
+    def test_suggests_names_by_word_prefix_without_queries(self):
+        self.client.get(self.url, {"prefix": "warm up"})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"prefix": "PIZ"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["restaurants"], [{"id": self.pizzeria.id, "name": "Napoli Pizzeria"}])
+        self.assertEqual(
+            response.data["items"],
+            [{"item_id": self.pizza.item_id, "name": "Pepperoni Pizza", "restaurant": self.pizzeria.id}],
+        )
+
+    def test_index_follows_saves_and_deletes(self):
+        self.client.get(self.url, {"prefix": "warm up"})
+        self.pizza.name = "Margherita"
+        self.pizza.save()
+        fries = Item.objects.create(restaurant=self.pizzeria, name="Pizza Fries", price=2)
+        response = self.client.get(self.url, {"prefix": "fri"})
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [fries.item_id])
+
+        self.pizzeria.delete()
+
+        response = self.client.get(self.url, {"prefix": "marg"})
+        self.assertEqual(response.data["restaurants"], [])
+        self.assertEqual(response.data["items"], [])
+
+        response = self.client.get(self.url, {"prefix": "piz", "limit": 50})
+        self.assertEqual(response.data["restaurants"], [])
+        self.assertEqual(response.data["items"], [])
+
+    def test_limit_is_validated(self):
+        response = self.client.get(self.url, {"prefix": "p", "limit": "zero"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_each_list_is_filled_up_to_its_limit(self):
+        Item.objects.bulk_create(Item(restaurant=self.pizzeria, name=f"Pasta {i}", price=5) for i in range(30))
+        suggestion_index.reset()
+        suggestions = suggestion_index.suggest("p", 3)
+        self.assertEqual(len(suggestions["item"]), 3)
+        self.assertEqual(list(suggestions["restaurant"]), [self.pizzeria.id])
+
+    def _rebuild_in_place(self):
+        # Run the background rebuild in this thread, where the test transaction is visible.
+        def start_now(target, **kwargs):
+            return mock.Mock(start=target)
+        return mock.patch("restaurant.autocomplete.threading.Thread", side_effect=start_now)
+
+    def test_writes_from_other_processes_trigger_a_rebuild(self):
+        suggestion_index.suggest("warm up", 5)
+        # Another process adds an item and, on commit, bumps the shared version.
+        other = Item.objects.bulk_create([Item(restaurant=self.pizzeria, name="Pizza Fritta", price=4)])[0]
+        cache.incr(suggestion_index.VERSION_KEY)
+
+        self.assertEqual(suggestion_index.suggest("fri", 5)["item"], {})
+        with mock.patch.object(suggestion_index, "VERSION_CHECK_SECONDS", 0), self._rebuild_in_place():
+            self.assertIn(other.item_id, suggestion_index.suggest("fri", 5)["item"])
+            with self.assertNumQueries(0):
+                suggestion_index.suggest("fri", 5)
+
+    def test_old_indexes_are_rebuilt(self):
+        suggestion_index.suggest("warm up", 5)
+        Item.objects.filter(pk=self.pizza.pk).update(name="Calzone")
+        with mock.patch.object(suggestion_index, "VERSION_CHECK_SECONDS", 0), \
+                mock.patch.object(suggestion_index, "MAX_AGE_SECONDS", 0), self._rebuild_in_place():
+            self.assertIn(self.pizza.item_id, suggestion_index.suggest("calz", 5)["item"])
+
+    def test_own_writes_do_not_look_stale(self):
+        suggestion_index.suggest("warm up", 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(restaurant=self.pizzeria, name="Pizza Fritta", price=4)
+        with mock.patch.object(suggestion_index, "VERSION_CHECK_SECONDS", 0), self._rebuild_in_place():
+            with self.assertNumQueries(0):
+                self.assertEqual(len(suggestion_index.suggest("fri", 5)["item"]), 1)
+
+
+class TestFuzzySearch(APITestCase):
+    def setUp(self):
+        for index in TRIGRAM_INDEXES.values():
+            index.reset()
+        managers = [
+            User.objects.create_user(
+                phone_number=f"555060000{i}",
+                password="manager_pass",
+                first_name="Manager",
+                role="restaurant_manager",
+            )
+            for i in range(2)
+        ]
+        self.pizzeria = RestaurantProfile.objects.create(manager=managers[0], name="Napoli Pizzeria", state="approved")
+        self.kebab = RestaurantProfile.objects.create(manager=managers[1], name="Shandiz Kebab", state="approved")
+        self.pizza = Item.objects.create(restaurant=self.pizzeria, name="Pizza", price=9)
+        Item.objects.create(restaurant=self.kebab, name="Koobideh", price=7)
+        self.url = reverse("restaurant-profile-list")
+
+    def test_trigrams_follow_pg_trgm_padding(self):
+        self.assertEqual(trigrams("Pizza"), {"  p", " pi", "piz", "izz", "zza", "za "})
+
+    def test_misspelled_query_falls_back_to_fuzzy_match(self):
+        response = self.client.get(self.url, {"query": "piza"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.pizzeria.id])
+        self.assertEqual([i["item_id"] for i in response.data["items"]], [self.pizza.item_id])
+
+        response = self.client.get(self.url, {"query": "shandis"})
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [self.kebab.id])
+        self.assertEqual(response.data["items"], [])
+
+    def test_fuzzy_index_follows_writes(self):
+        self.client.get(self.url, {"query": "piza"})
+        self.pizza.name = "Pasta"
+        self.pizza.save()
+        self.assertEqual(TRIGRAM_INDEXES[Item].search("piza"), {})
+        self.assertIn(self.pizza.item_id, TRIGRAM_INDEXES[Item].search("pastaa"))
+
+    def test_ineligible_matches_do_not_crowd_out_eligible_ones(self):
+        managers = User.objects.bulk_create(
+            User(phone_number=f"555061{i:04d}", role="restaurant_manager") for i in range(250)
+        )
+        RestaurantProfile.objects.bulk_create(
+            RestaurantProfile(manager=manager, name="Pizzeria", state="pending") for manager in managers[1:]
+        )
+        RestaurantProfile.objects.filter(pk=self.pizzeria.pk).update(state="pending")
+        # Ties are broken by pk, so the only approved match ranks last among equals.
+        approved = RestaurantProfile.objects.create(manager=managers[0], name="Pizzeria", state="approved")
+        TRIGRAM_INDEXES[RestaurantProfile].reset()
+        self.assertGreater(len(TRIGRAM_INDEXES[RestaurantProfile].search("pizzera", limit=None)), MAX_CANDIDATES)
+
+        response = self.client.get(self.url, {"query": "pizzera"})
+        self.assertEqual([r["id"] for r in response.data["restaurants"]], [approved.id])
+
+
+class TestSearchResponseCache(APITestCase):
+    def setUp(self):
+        manager = User.objects.create_user(
+            phone_number="5550700000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager, name="Cache Pizzeria", state="approved")
+        self.item = Item.objects.create(restaurant=self.restaurant, name="Pizza", price=9)
+        self.url = reverse("restaurant-profile-list")
+        search_cache.reset_stats()
+
+    def test_repeated_query_is_served_from_cache(self):
+        first = self.client.get(self.url, {"query": "Pizza", "is_open": "true"})
+        self.assertEqual(first["X-Cache"], "MISS")
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {"query": "  pizza ", "is_open": "true"})
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+
+        self.assertEqual(self.client.get(self.url, {"query": "pizza"})["X-Cache"], "MISS")
+        self.assertEqual(search_cache.stats(), {"hits": 1, "misses": 2, "hit_ratio": 0.3333})
+
+    def test_item_change_invalidates_cached_results(self):
+        self.client.get(self.url, {"query": "pizza"})
+        self.item.name = "Pasta"
+        self.item.save()
+
+        response = self.client.get(self.url, {"query": "pizza"})
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["items"], [])
+
+    def test_nearby_requests_bypass_cache(self):
+        params = {"nearby": "true", "latitude": 35.7, "longitude": 51.4}
+        self.client.get(self.url, params)
+        self.assertEqual(self.client.get(self.url, params)["X-Cache"], "BYPASS")
+
+    def test_stats_endpoint_reports_the_serving_process(self):
+        stats_url = reverse("search-cache-stats")
+        admin = User.objects.create_user(
+            phone_number="5550700001", password="admin_pass", first_name="Admin", role="admin", is_staff=True
+        )
+        self.client.get(self.url, {"query": "pizza"})
+        self.client.get(self.url, {"query": "pizza"})
+
+        self.client.force_authenticate(user=self.restaurant.manager)
+        self.assertEqual(self.client.get(stats_url).status_code, 403)
+
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(stats_url)
+        self.assertEqual(response.data, {"hits": 1, "misses": 1, "hit_ratio": 0.5, "shared": False})
+
+        self.assertEqual(self.client.delete(stats_url).status_code, 204)
+        self.assertEqual(search_cache.stats()["hits"], 0)
+
+    def test_stats_command_warns_about_per_process_counters(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("search_cache_stats", stdout=stdout, stderr=stderr)
+        self.assertIn("hits=0", stdout.getvalue())
+        self.assertIn("search-cache/stats", stderr.getvalue())
+
+
+class TestSearchFacets(APITestCase):
+    # 2024-01-01 is a Monday; the cafe is open at noon, the restaurants are not.
+    NOON = timezone.make_aware(datetime(2024, 1, 1, 12))
+
+    def setUp(self):
+        cache.clear()
+        search_cache.invalidate()
+        self.cafe = self._create("Facet Cafe", "cafe", "08:00", "16:00")
+        self.restaurant = self._create("Facet Grill", "restaurant", "18:00", "23:00")
+        self._create("Facet Kebab", "restaurant", "18:00", "23:00")
+        self._create("Other Bakery", "bakery", "08:00", "16:00")
+        self.url = reverse("restaurant-profile-list")
+
+    def _create(self, name, business_type, open_hour, close_hour):
+        manager = User.objects.create_user(
+            phone_number=f"555080{RestaurantProfile.objects.count():04d}",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        return RestaurantProfile.objects.create(
+            manager=manager, name=name, business_type=business_type, state="approved",
+            open_hour=open_hour, close_hour=close_hour,
+        )
+
+    def _facets(self, params):
+        with mock.patch("restaurant.schedule.timezone.now", return_value=self.NOON):
+            return self.client.get(self.url, params).data["facets"]
+
+    def test_facets_count_search_results(self):
+        facets = self._facets({"query": "facet"})
+        self.assertEqual(facets["business_type"], {
+            "restaurant": 2, "cafe": 1, "bakery": 0, "sweets": 0, "ice_cream": 0,
+        })
+        self.assertEqual(facets["open_now"], 1)
+
+    def test_each_facet_ignores_its_own_filter(self):
+        facets = self._facets({"query": "facet", "is_open": "true", "business_type": "restaurant"})
+        self.assertEqual(facets["business_type"]["cafe"], 1)
+        self.assertEqual(facets["business_type"]["restaurant"], 0)
+        self.assertEqual(facets["open_now"], 0)
+
+    def test_facets_are_one_query(self):
+        with self.assertNumQueries(1):
+            facet_counts(RestaurantProfile.objects.filter(state="approved"), open_now_filter(self.NOON))
+
+    def test_open_filter_does_not_grow_with_open_restaurants(self):
+        def params():
+            open_now = open_now_filter(self.NOON)
+            queryset = RestaurantProfile.objects.filter(open_now).annotate(
+                open_count=Count("pk", filter=open_now)
+            )
+            return len(queryset.query.sql_with_params()[1])
+
+        before = params()
+        for index in range(5):
+            self._create(f"Open Cafe {index}", "cafe", "08:00", "16:00")
+        self.assertEqual(params(), before)
+
+
+class TestMenuCache(APITestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5550900000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.customer = User.objects.create_user(
+            phone_number="5550900001",
+            password="customer_pass",
+            first_name="Customer",
+            role="customer",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=self.manager, name="Menu Cache", state="approved")
+        self.item = Item.objects.create(restaurant=self.restaurant, name="Burger", price=8)
+        self.url = reverse("menu-items", kwargs={"restaurant_id": self.restaurant.id})
+        self.detail_url = reverse(
+            "menu-item-detail", kwargs={"restaurant_id": self.restaurant.id, "item_id": self.item.item_id}
+        )
+
+    def test_cached_menu_costs_one_version_lookup(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(2):
+            menu = self.client.get(self.url)
+            item = self.client.get(self.detail_url)
+        self.assertEqual(menu.json()[0]["name"], "Burger")
+        self.assertEqual(item.json()["item_id"], self.item.item_id)
+
+    def test_manager_edits_are_written_through(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(user=self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse("item-detail", kwargs={"pk": self.item.pk}), {"name": "Cheeseburger", "price": 9})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()[0]["name"], "Cheeseburger")
+
+    def test_reviews_rerender_menu_in_background(self):
+        order = Order.objects.create(user=self.customer, restaurant=self.restaurant, total_price=8)
+        OrderItem.objects.create(order=order, item=self.item, count=1, price=8)
+        with mock.patch.object(menu_cache, "rebuild_in_background") as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                Review.objects.create(user=self.customer, order=order, score=4)
+        rebuild.assert_called_once_with(self.restaurant.id)
+
+    def test_render_overtaken_by_an_edit_is_not_cached(self):
+        cache.clear()
+        def render_then_edit(*args, **kwargs):
+            rendered = ItemSerializer(*args, **kwargs).data
+            # The manager's edit lands after the old menu was read but before it is cached.
+            self.item.name = "Cheeseburger"
+            self.item.save()
+            return mock.Mock(data=rendered)
+
+        with mock.patch("restaurant.menu.ItemSerializer", render_then_edit):
+            stale = menu_cache.rebuild(self.restaurant.id)
+        self.assertIn(b'"Burger"', stale.menu)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()[0]["name"], "Cheeseburger")
+        self.assertEqual(response["ETag"], menu_etag(self.restaurant.id, stale.version + 1))
+
+    def test_deleted_restaurant_menu_is_not_served(self):
+        self.client.get(self.url)
+        self.restaurant.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_warm_menu_cache_command(self):
+        out, err = StringIO(), StringIO()
+        call_command("warm_menu_cache", stdout=out, stderr=err)
+        self.assertIn("1 restaurants", out.getvalue())
+        self.assertIn("CACHE_URL", err.getvalue())
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_changes_from_other_processes_are_served_at_once(self):
+        stale = self.client.get(self.url)
+        # rebuild_scores and other workers bump the version without touching this process's cache.
+        Item.objects.filter(pk=self.item.pk).update(name="Veggie Burger")
+        bump_menu_version(RestaurantProfile.objects.filter(pk=self.restaurant.pk))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=stale["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["name"], "Veggie Burger")
+        self.assertNotEqual(response["ETag"], stale["ETag"])
+
+
+class TestItemBulkImport(APITestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(
+            phone_number="5551000000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=self.manager, name="Bulk Diner", state="approved")
+        self.soup = Item.objects.create(restaurant=self.restaurant, name="Tomato Soup", price=4)
+        self.salad = Item.objects.create(restaurant=self.restaurant, name="Salad", price=5)
+        self.url = reverse("item-bulk-import")
+        self.client.force_authenticate(user=self.manager)
+
+    def test_json_import_creates_and_updates_in_bulk(self):
+        rows = [{"name": "Pasta {}".format(i), "price": "7.50"} for i in range(50)]
+        rows += [{"item_id": self.soup.pk, "price": "4.50"}, {"name": "  salad ", "discount": 10}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"items": rows}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["created"]), 50)
+        self.assertEqual(response.data["updated"], [self.soup.pk, self.salad.pk])
+        self.soup.refresh_from_db()
+        self.salad.refresh_from_db()
+        self.assertEqual((self.soup.name, self.soup.price), ("Tomato Soup", Decimal("4.50")))
+        self.assertEqual((self.salad.name, self.salad.discount), ("salad", 10))
+        # The in-process indexes are refreshed although bulk writes send no signals.
+        self.assertEqual(len(suggestion_index.suggest("pasta", 100)["item"]), 50)
+        self.assertEqual(len(self.client.get(reverse("menu-items", kwargs={"restaurant_id": self.restaurant.id})).json()), 52)
+
+    def test_csv_import(self):
+        body = "name,price,description\nFalafel,3.00,\nHummus,2.50,With bread\n"
+        response = self.client.generic("POST", self.url, body, content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Item.objects.get(name="Hummus").description, "With bread")
+        self.assertIsNone(Item.objects.get(name="Falafel").description)
+
+    def test_invalid_rows_are_reported_and_nothing_is_saved(self):
+        rows = [
+            {"name": "Kebab", "price": "9"},
+            {"price": "1"},
+            {"item_id": 99999, "price": "1"},
+            {"name": "Wrap", "discount": 150},
+            {"name": "kebab", "price": "8"},
+        ]
+        response = self.client.post(self.url, rows, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["row"] for error in response.data["errors"]], [2, 3, 4, 5])
+        self.assertIn("name", response.data["errors"][0]["errors"])
+        self.assertFalse(Item.objects.filter(name="Kebab").exists())
+
+
+class TestThumbnails(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage_override = override_settings(MEDIA_ROOT=self.media.name)
+        storage_override.enable()
+        self.addCleanup(storage_override.disable)
+
+        manager = User.objects.create_user(
+            phone_number="5551100000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager, name="Photo Grill", state="approved")
+
+    def _png(self, size=(1200, 800)):
+        output = BytesIO()
+        Image.new("RGBA", size, (200, 30, 30, 128)).save(output, "PNG")
+        return SimpleUploadedFile("dish.png", output.getvalue(), content_type="image/png")
+
+    def test_variants_are_stored_next_to_the_original(self):
+        with mock.patch.object(thumbnail_pool, "submit") as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                item = Item.objects.create(restaurant=self.restaurant, name="Steak", price=20, photo=self._png())
+        submit.assert_called_once_with(item.photo.name)
+
+        generate_thumbnails(item.photo.name)
+        urls = ItemSerializer(item).data["thumbnails"]
+        self.assertEqual(set(urls), {"small", "medium"})
+        self.assertTrue(urls["small"]["webp"].endswith(item.photo.name[:-4] + "_small.webp"))
+
+        with Image.open(item.photo.storage.open(variant_name(item.photo.name, "medium", "jpeg"))) as medium:
+            self.assertEqual((medium.format, medium.size), ("JPEG", (480, 320)))
+        with Image.open(item.photo.storage.open(variant_name(item.photo.name, "small", "webp"))) as small:
+            self.assertEqual((small.format, small.size), ("WEBP", (160, 107)))
+
+    def test_original_is_advertised_until_variants_are_stored(self):
+        cache.clear()
+        item = Item.objects.create(restaurant=self.restaurant, name="Steak", price=20, photo=self._png((300, 300)))
+        urls = ItemSerializer(item).data["thumbnails"]
+        self.assertEqual({url for formats in urls.values() for url in formats.values()}, {item.photo.url})
+        stale = menu_cache.get(self.restaurant.pk)
+
+        generate_thumbnails(item.photo.name)
+        self.assertTrue(ItemSerializer(item).data["thumbnails"]["small"]["webp"].endswith("_small.webp"))
+        fresh = menu_cache.get(self.restaurant.pk)
+        self.assertGreater(fresh.version, stale.version)
+        self.assertIn(b"_small.webp", fresh.menu)
+
+    @override_settings(STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    })
+    def test_variants_use_the_photo_storage_not_the_default_one(self):
+        item = Item.objects.create(restaurant=self.restaurant, name="Steak", price=20, photo=self._png((300, 300)))
+        generate_thumbnails(item.photo.name)
+
+        small = variant_name(item.photo.name, "small", "webp")
+        self.assertTrue(item.photo.storage.exists(small))
+        self.assertFalse(default_storage.exists(small))
+        self.assertTrue(has_thumbnails(item.photo.name))
+
+    def test_backfill_command_uses_the_process_pool(self):
+        item = Item.objects.create(restaurant=self.restaurant, name="Steak", price=20, photo=self._png((300, 300)))
+        out = StringIO()
+        call_command("generate_thumbnails", stdout=out)
+        self.assertIn("Generated thumbnails for 1 photos", out.getvalue())
+        self.assertTrue(has_thumbnails(item.photo.name))
+
+    def test_no_photo_has_no_thumbnails(self):
+        item = Item.objects.create(restaurant=self.restaurant, name="Water", price=1)
+        self.assertIsNone(ItemSerializer(item).data["thumbnails"])
+
+
+class TestPhotoUploads(APITestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage_override = override_settings(MEDIA_ROOT=self.media.name)
+        storage_override.enable()
+        self.addCleanup(storage_override.disable)
+
+        self.manager = User.objects.create_user(
+            phone_number="5551200000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        RestaurantProfile.objects.create(manager=self.manager, name="Upload Grill", state="approved")
+        self.url = reverse("item-list-create")
+        self.client.force_authenticate(user=self.manager)
+
+    def _post(self, name, content):
+        photo = SimpleUploadedFile(name, content)
+        return self.client.post(self.url, {"name": "Steak", "price": "20.00", "photo": photo}, format="multipart")
+
+    def _jpeg(self):
+        output = BytesIO()
+        Image.new("RGB", (64, 48), "red").save(output, "JPEG")
+        return output.getvalue()
+
+    def test_format_is_sniffed_from_content(self):
+        response = self._post("dish.png", self._jpeg())
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Item.objects.get(name="Steak").photo.name.endswith(".jpg"))
+
+    def test_non_image_is_rejected(self):
+        response = self._post("dish.png", b"<?php echo 'not an image'; ?>")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JPEG or PNG", response.data["detail"])
+
+    def test_truncated_image_header_is_rejected(self):
+        response = self._post("dish.png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 16)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("not a valid image", response.data["detail"])
+
+    def test_oversized_upload_is_aborted_while_streaming(self):
+        content = self._jpeg() + b"\x00" * (2 * 1024 * 1024)
+        with mock.patch.object(PhotoUploadHandler, "file_complete") as file_complete:
+            response = self._post("dish.jpg", content)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("2MB", response.data["detail"])
+        file_complete.assert_not_called()
+        self.assertFalse(Item.objects.filter(name="Steak").exists())
+
+
+class TestContentAddressedPhotos(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        storage_override = override_settings(MEDIA_ROOT=self.media.name)
+        storage_override.enable()
+        self.addCleanup(storage_override.disable)
+
+        manager = User.objects.create_user(
+            phone_number="5551300000",
+            password="manager_pass",
+            first_name="Manager",
+            role="restaurant_manager",
+        )
+        self.restaurant = RestaurantProfile.objects.create(manager=manager, name="Chain Branch", state="approved")
+        output = BytesIO()
+        Image.new("RGB", (32, 32), "blue").save(output, "PNG")
+        self.content = output.getvalue()
+        self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def _item(self, name):
+        photo = SimpleUploadedFile(f"{name}.png", self.content, content_type="image/png")
+        return Item.objects.create(restaurant=self.restaurant, name=name, price=1, photo=photo)
+
+    def test_identical_uploads_share_one_sharded_file(self):
+        first, second = self._item("Tea"), self._item("Coffee")
+        expected = f"item_images/{self.digest[:2]}/{self.digest[2:4]}/{self.digest}.png"
+        self.assertEqual((first.photo.name, second.photo.name), (expected, expected))
+        self.assertEqual(os.listdir(os.path.dirname(first.photo.path)), [f"{self.digest}.png"])
+        self.assertEqual(StoredPhoto.objects.get(name=expected).ref_count, 2)
+
+    def test_long_jpeg_names_are_not_truncated(self):
+        output = BytesIO()
+        Image.new("RGB", (32, 32), "red").save(output, "JPEG")
+        digest = hashlib.sha256(output.getvalue()).hexdigest()
+        names = set()
+        for _ in range(2):
+            self.restaurant.photo = SimpleUploadedFile("front.jpeg", output.getvalue(), content_type="image/jpeg")
+            self.restaurant.save()
+            names.add(self.restaurant.photo.name)
+        self.assertEqual(names, {f"restaurant-ptofile-images/{digest[:2]}/{digest[2:4]}/{digest}.jpg"})
+        self.assertEqual(os.listdir(os.path.dirname(self.restaurant.photo.path)), [f"{digest}.jpg"])
+
+    def test_racing_saves_of_the_same_content_share_the_name(self):
+        first = self._item("Tea")
+        storage = first.photo.storage
+        # The other save lands after this one checked for the file.
+        with mock.patch.object(type(storage), "exists", return_value=False):
+            name = storage.save("item_images/tea.png", ContentFile(self.content))
+        self.assertEqual(name, first.photo.name)
+        self.assertEqual(os.listdir(os.path.dirname(first.photo.path)), [f"{self.digest}.png"])
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        first, second = self._item("Tea"), self._item("Coffee")
+        path = first.photo.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.photo = None
+            second.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredPhoto.objects.exists())
@@ -0,0 +1,109 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+
+from .imaging import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, render_thumbnails, variant_name
+from .models import RestaurantProfile, Item
+from .storage import photo_storage
+
+
+# Resized WebP/JPEG variants of item and restaurant photos. After an upload is committed the
+# original is handed to a process pool (resizing is CPU bound and would hold the GIL) and the
+# variants are written next to it, in the photo fields' storage. Variant names derive from the
+# original's name, so the serializers build their URLs without a database lookup. The last
+# variant is always written last and marks the set as complete; until it exists every variant
+# URL points at the original photo. Once the variants are stored ``thumbnails_stored`` is sent,
+# so caches holding the fallback URLs can drop them.
+
+logger = logging.getLogger(__name__)
+
+READY_VARIANT = (list(THUMBNAIL_SIZES)[-1], list(THUMBNAIL_FORMATS)[-1])
+
+# Sent with ``name``, the stored original, once all of its variants exist.
+thumbnails_stored = Signal()
+
+
+def thumbnail_urls(photo) -> dict:
+    """``{size: {extension: url}}`` for a photo field, or ``None`` when there is no photo."""
+    if not photo:
+        return None
+    if not has_thumbnails(photo.name):
+        return {size: {extension: photo.url for extension in THUMBNAIL_FORMATS} for size in THUMBNAIL_SIZES}
+    return {
+        size: {extension: photo.storage.url(variant_name(photo.name, size, extension)) for extension in THUMBNAIL_FORMATS}
+        for size in THUMBNAIL_SIZES
+    }
+
+
+def has_thumbnails(name) -> bool:
+    return photo_storage.exists(variant_name(name, *READY_VARIANT))
+
+
+def save_thumbnails(name, variants):
+    # False sorts first, so the ready marker is written after every other variant.
+    for (size, extension), content in sorted(variants.items(), key=lambda variant: variant[0] == READY_VARIANT):
+        photo_storage.replace(variant_name(name, size, extension), ContentFile(content))
+    thumbnails_stored.send(sender=None, name=name)
+
+
+def generate_thumbnails(name):
+    """Render and store the variants of the stored image ``name`` in the calling process."""
+    with photo_storage.open(name, 'rb') as source:
+        save_thumbnails(name, render_thumbnails(source.read()))
+
+
+class ThumbnailPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # "spawn" keeps the web process's sockets and threads out of the workers.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.THUMBNAIL_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def render(self, name):
+        """Render the variants of the stored image ``name`` in a worker process; returns a future."""
+        with photo_storage.open(name, 'rb') as source:
+            return self.executor.submit(render_thumbnails, source.read())
+
+    def submit(self, name):
+        """Render ``name`` in the background and store its variants when done."""
+        future = self.render(name)
+        future.add_done_callback(lambda done: self._store(name, done))
+        return future
+
+    @staticmethod
+    def _store(name, future):
+        try:
+            save_thumbnails(name, future.result())
+        except Exception:
+            logger.exception("Could not generate thumbnails for %s", name)
+        finally:
+            # Runs on the pool's result thread; thumbnails_stored receivers may have queried.
+            connections.close_all()
+
+
+thumbnail_pool = ThumbnailPool()
+
+
+@receiver(post_save, sender=RestaurantProfile)
+@receiver(post_save, sender=Item)
+def schedule_thumbnails(sender, instance, update_fields=None, **kwargs):
+    if not instance.photo or (update_fields is not None and 'photo' not in update_fields):
+        return
+    name = instance.photo.name
+    if not has_thumbnails(name):
+        transaction.on_commit(lambda: thumbnail_pool.submit(name))
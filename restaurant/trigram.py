@@ -0,0 +1,100 @@
+import threading
+from collections import Counter, defaultdict
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RestaurantProfile, Item
+
+
+# Pure-Python trigram inverted index over restaurant and item names, used for typo-tolerant
+# search where pg_trgm is not available. Trigrams follow pg_trgm (lower-cased words padded
+# with two leading and one trailing space), and the score approximates word_similarity: the
+# fraction of the query's trigrams found in the name. Only posting lists of the query's
+# trigrams are visited, so lookups never scan the whole table.
+
+FUZZY_THRESHOLD = 0.6
+MAX_CANDIDATES = 200
+
+
+def trigrams(text: str) -> set:
+    grams = set()
+    for word in (text or '').casefold().split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    def __init__(self, model, name_field='name'):
+        self.model = model
+        self.name_field = name_field
+        self._lock = threading.RLock()
+        self._postings = defaultdict(set)
+        self._grams = {}
+        self._built = False
+
+    def reset(self):
+        with self._lock:
+            self._postings, self._grams, self._built = defaultdict(set), {}, False
+
+    def build(self):
+        with self._lock:
+            self.reset()
+            rows = self.model.objects.values_list('pk', self.name_field)
+            for pk, name in rows.iterator(chunk_size=2000):
+                self._add(pk, name)
+            self._built = True
+
+    def update(self, pk, name):
+        with self._lock:
+            if self._built:
+                self.remove(pk)
+                self._add(pk, name)
+
+    def remove(self, pk):
+        with self._lock:
+            for gram in self._grams.pop(pk, ()):
+                self._postings[gram].discard(pk)
+
+    def search(self, query: str, threshold=FUZZY_THRESHOLD, limit=None) -> dict:
+        """
+        Return ``{pk: score}``, best first, for the names scoring at least ``threshold``; only the
+        best ``limit`` when given. The index covers every row, so callers that filter (approved
+        restaurants, nearby, ...) must apply their filter before cutting the list short.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return {}
+        with self._lock:
+            if not self._built:
+                self.build()
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self._postings.get(gram, ()))
+        scores = ((pk, count / len(query_grams)) for pk, count in shared.items())
+        matches = sorted((item for item in scores if item[1] >= threshold), key=lambda item: (-item[1], item[0]))
+        return dict(matches[:limit] if limit is not None else matches)
+
+    def _add(self, pk, name):
+        grams = trigrams(name)
+        self._grams[pk] = grams
+        for gram in grams:
+            self._postings[gram].add(pk)
+
+
+TRIGRAM_INDEXES = {
+    RestaurantProfile: TrigramIndex(RestaurantProfile),
+    Item: TrigramIndex(Item),
+}
+
+
+@receiver(post_save, sender=RestaurantProfile)
+@receiver(post_save, sender=Item)
+def index_name_trigrams(sender, instance, **kwargs):
+    TRIGRAM_INDEXES[sender].update(instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=RestaurantProfile)
+@receiver(post_delete, sender=Item)
+def unindex_name_trigrams(sender, instance, **kwargs):
+    TRIGRAM_INDEXES[sender].remove(instance.pk)
@@ -0,0 +1,93 @@
+import hashlib
+import os
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image
+
+from .models import MAX_PHOTO_SIZE_MB
+
+
+# Upload handling for the photo endpoints. Files stream straight to a temporary file and the
+# upload is aborted as soon as it passes the size limit, so an oversized or hostile body never
+# sits in worker memory. The real format is taken from the leading magic bytes, not from the
+# client's filename, and Pillow's lazy open reads the dimensions from the header only. The
+# content hash used by the photo storage is computed on the same pass.
+
+MAX_PHOTO_SIZE = MAX_PHOTO_SIZE_MB * 1024 * 1024
+MAX_PHOTO_PIXELS = 6000 * 6000
+
+# Magic bytes -> (Pillow format, canonical extension).
+PHOTO_SIGNATURES = {
+    b'\xff\xd8\xff': ('JPEG', 'jpg'),
+    b'\x89PNG\r\n\x1a\n': ('PNG', 'png'),
+}
+SNIFF_LENGTH = max(len(signature) for signature in PHOTO_SIGNATURES)
+
+
+class PhotoUploadError(MultiPartParserError):
+    """Rejected photo upload; DRF's multipart parser turns it into a 400 response."""
+
+
+class PhotoUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.content_length is not None and self.content_length > MAX_PHOTO_SIZE:
+            self._reject(f"Photo size must not exceed {MAX_PHOTO_SIZE_MB}MB.")
+        self.received = 0
+        self.header = b''
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > MAX_PHOTO_SIZE:
+            self._reject(f"Photo size must not exceed {MAX_PHOTO_SIZE_MB}MB.")
+        if len(self.header) < SNIFF_LENGTH:
+            self.header += raw_data[:SNIFF_LENGTH - len(self.header)]
+            if len(self.header) >= SNIFF_LENGTH and self._sniff() is None:
+                self._reject("Photo must be a JPEG or PNG image.")
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        signature = self._sniff()
+        if signature is None:
+            self._reject("Photo must be a JPEG or PNG image.")
+        image_format, extension = signature
+
+        file = super().file_complete(file_size)
+        try:
+            # Image.open only parses the header; pixel data is never decoded here.
+            with Image.open(file.temporary_file_path()) as image:
+                if image.format != image_format:
+                    raise ValueError(image.format)
+                width, height = image.size
+        except (OSError, ValueError, Image.DecompressionBombError):
+            self._reject("Photo is not a valid image.")
+        if width * height > MAX_PHOTO_PIXELS:
+            self._reject("Photo dimensions are too large.")
+
+        file.seek(0)
+        # Name the file after what it is, whatever the client called it.
+        file.name = f'{os.path.splitext(file.name)[0]}.{extension}'
+        file.image_size = (width, height)
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+    def _sniff(self):
+        for signature, result in PHOTO_SIGNATURES.items():
+            if self.header.startswith(signature):
+                return result
+        return None
+
+    def _reject(self, message):
+        self.upload_interrupted()
+        raise PhotoUploadError(message)
+
+
+class PhotoUploadMixin:
+    """Installs ``PhotoUploadHandler`` on views that accept photo uploads."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [PhotoUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
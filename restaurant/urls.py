@@ -1,15 +1,23 @@
 from django.urls import path
-from .views import MyRestaurantProfileView, PublicRestaurantProfileView, ItemListCreateView, ItemDetailView, RestaurantListView, SalesReportView
-from order.views import RestaurantOrderListView, UpdateOrderStatusView
+from .views import MyRestaurantProfileView, PublicRestaurantProfileView, ItemListCreateView, ItemDetailView, RestaurantListView, SalesReportView, \
+    AutocompleteView, ItemBulkImportView, SearchCacheStatsView
+from order.views import RestaurantOrderListView, UpdateOrderStatusView, OrderEventListView, RestaurantOrderStreamView, \
+    OrderStreamTokenView
 
 urlpatterns = [
     path('profiles', RestaurantListView.as_view(), name='restaurant-profile-list'),
+    path('search-cache/stats', SearchCacheStatsView.as_view(), name='search-cache-stats'),
+    path('autocomplete', AutocompleteView.as_view(), name='restaurant-autocomplete'),
     path('profiles/me', MyRestaurantProfileView.as_view(), name='restaurant-profile'),
     path('profiles/<int:id>', PublicRestaurantProfileView.as_view(), name='public-restaurant-profile'),
     path('items', ItemListCreateView.as_view(), name='item-list-create'),
+    path('items/bulk', ItemBulkImportView.as_view(), name='item-bulk-import'),
     path('items/<int:pk>', ItemDetailView.as_view(), name='item-detail'),
     path('orders', RestaurantOrderListView.as_view(), name='order-list'),
+    path('orders/stream', RestaurantOrderStreamView.as_view(), name='order-stream'),
+    path('orders/stream/token', OrderStreamTokenView.as_view(), name='order-stream-token'),
     path('orders/<int:id>/status', UpdateOrderStatusView.as_view(), name='update-order-status'),
+    path('orders/<int:id>/events', OrderEventListView.as_view(), name='order-event-list'),
     path('sales-reports', SalesReportView.as_view(), name='sales-report'),
 
 ]
@@ -1,23 +1,32 @@
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from django.utils import timezone
 from django.http import Http404
 from django.db import models
-from django.db.models import Sum, F
+from django.db.models import Sum, F, Q
 from rest_framework.views import APIView
 from rest_framework import generics
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.exceptions import ValidationError
 from rest_framework import status
 from .models import RestaurantProfile, Item
-from .serializers import RestaurantProfileSerializer, ItemSerializer
+from .serializers import RestaurantProfileSerializer, ItemSerializer, ItemImportSerializer
 from .permissions import IsRestaurantManager
 from .report_strategies import SALES_REPORT_STRATEGIES
-import pytz
-
-
-class MyRestaurantProfileView(APIView):
+from .search import get_search_backend, facet_counts
+from .pagination import SearchResultsPagination
+from .services import GeoLocator
+from .schedule import open_now_filter
+from .autocomplete import suggestion_index, RESTAURANT, ITEM
+from .search_cache import search_cache
+from .menu import menu_cache
+from .menu_import import MenuImporter
+from .parsers import CSVParser
+from .uploads import PhotoUploadMixin
+
+
+class MyRestaurantProfileView(PhotoUploadMixin, APIView):
     permission_classes = [IsAuthenticated, IsRestaurantManager]
 
 
@@ -88,7 +97,7 @@ class PublicRestaurantProfileView(generics.RetrieveAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class ItemListCreateView(generics.ListCreateAPIView):
+class ItemListCreateView(PhotoUploadMixin, generics.ListCreateAPIView):
     serializer_class = ItemSerializer
     permission_classes = [IsAuthenticated, IsRestaurantManager]
 
@@ -128,9 +137,10 @@ class ItemListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         restaurant = self.request.user.restaurant_profile
         serializer.save(restaurant=restaurant)
+        menu_cache.rebuild_on_commit(restaurant.pk)
 
 
-class ItemDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ItemDetailView(PhotoUploadMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ItemSerializer
     permission_classes = [IsAuthenticated, IsRestaurantManager]
 
@@ -192,7 +202,69 @@ class ItemDetailView(generics.RetrieveUpdateDestroyAPIView):
             raise Http404("Item not found.")
 
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        menu_cache.rebuild_on_commit(serializer.instance.restaurant_id)
+
+
+    def perform_destroy(self, instance):
+        restaurant_id = instance.restaurant_id
+        super().perform_destroy(instance)
+        menu_cache.rebuild_on_commit(restaurant_id)
+
+
+class ItemBulkImportView(APIView):
+    permission_classes = [IsAuthenticated, IsRestaurantManager]
+    parser_classes = [JSONParser, CSVParser]
+    MAX_ROWS = 2000
+
+
+    @swagger_auto_schema(
+        operation_summary="Bulk Import Items",
+        operation_description="Create or update many menu items at once from a JSON list (optionally wrapped "
+                              "as {\"items\": [...]}) or a text/csv body with a header row. Rows are matched to "
+                              "existing items by `item_id`, otherwise by name. Nothing is saved unless every "
+                              "row is valid.",
+        request_body=ItemImportSerializer(many=True),
+        responses={
+            200: openapi.Response(
+                description="Import summary.",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'created': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                        'updated': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    }
+                )
+            ),
+            400: "Invalid payload, or a list of per-row errors.",
+            401: "Unauthorized",
+            403: "Forbidden",
+            500: "Internal server error",
+        }
+    )
+    def post(self, request):
+        rows = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError("Expected a non-empty list of items.")
+        if len(rows) > self.MAX_ROWS:
+            raise ValidationError(f"At most {self.MAX_ROWS} items can be imported at once.")
+
+        importer = MenuImporter(request.user.restaurant_profile)
+        if not importer.run(rows):
+            return Response({'errors': importer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {
+                'created': [item.pk for item in importer.created],
+                'updated': [item.pk for item in importer.updated],
+            },
+            status=status.HTTP_200_OK
+        )
+
+
 class RestaurantListView(APIView):
+    DEFAULT_RADIUS_KM = 5
+    MAX_RADIUS_KM = 50
 
     @swagger_auto_schema(
         operation_summary="Search and filter restaurants and items by various criteria.",
@@ -200,7 +272,9 @@ class RestaurantListView(APIView):
             openapi.Parameter(
                 'query',
                 openapi.IN_QUERY,
-                description="Search term to find matching restaurants and items.",
+                description="Search term matched against the name and description of restaurants and items. "
+                            "Results are ordered by relevance. When nothing matches, names are matched "
+                            "fuzzily to tolerate typos.",
                 type=openapi.TYPE_STRING
             ),
             openapi.Parameter(
@@ -216,6 +290,51 @@ class RestaurantListView(APIView):
                 type=openapi.TYPE_STRING,
                 enum=["true", "false"]
             ),
+            openapi.Parameter(
+                'nearby',
+                openapi.IN_QUERY,
+                description='Only return restaurants around a point, nearest first ("true" to enable). '
+                            'Items are limited to those restaurants.',
+                type=openapi.TYPE_STRING,
+                enum=["true", "false"]
+            ),
+            openapi.Parameter(
+                'latitude',
+                openapi.IN_QUERY,
+                description="Latitude of the point for `nearby`. Defaults to the customer's stored location.",
+                type=openapi.TYPE_NUMBER
+            ),
+            openapi.Parameter(
+                'longitude',
+                openapi.IN_QUERY,
+                description="Longitude of the point for `nearby`. Defaults to the customer's stored location.",
+                type=openapi.TYPE_NUMBER
+            ),
+            openapi.Parameter(
+                'radius',
+                openapi.IN_QUERY,
+                description=f"Search radius in km for `nearby` (default {DEFAULT_RADIUS_KM}, max {MAX_RADIUS_KM}).",
+                type=openapi.TYPE_NUMBER
+            ),
+            openapi.Parameter(
+                'restaurants_cursor',
+                openapi.IN_QUERY,
+                description="Cursor for the restaurants page, taken from `restaurants_next`/`restaurants_previous`.",
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter(
+                'items_cursor',
+                openapi.IN_QUERY,
+                description="Cursor for the items page, taken from `items_next`/`items_previous`.",
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter(
+                'page_size',
+                openapi.IN_QUERY,
+                description=f"Results per page for each list (default {SearchResultsPagination.page_size}, "
+                            f"max {SearchResultsPagination.max_page_size}).",
+                type=openapi.TYPE_INTEGER
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -230,7 +349,23 @@ class RestaurantListView(APIView):
                         'items': openapi.Schema(
                             type=openapi.TYPE_ARRAY,
                             items=openapi.Schema(type=openapi.TYPE_OBJECT)
-                        )
+                        ),
+                        'restaurants_next': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'restaurants_previous': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'items_next': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'items_previous': openapi.Schema(type=openapi.TYPE_STRING, x_nullable=True),
+                        'facets': openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            description="Restaurant counts per business type and open now. Each facet "
+                                        "honours every other filter but not its own.",
+                            properties={
+                                'business_type': openapi.Schema(
+                                    type=openapi.TYPE_OBJECT,
+                                    additional_properties=openapi.Schema(type=openapi.TYPE_INTEGER)
+                                ),
+                                'open_now': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            }
+                        ),
                     }
                 )
             ),
@@ -242,38 +377,196 @@ class RestaurantListView(APIView):
         query = request.query_params.get('query', '').strip()
         business_type = request.query_params.get('business_type', None)
         is_open = request.query_params.get('is_open', None)
+        nearby = request.query_params.get('nearby', '').lower() == 'true'
 
-        desired_timezone = pytz.timezone('Asia/Tehran')
-        current_time = timezone.now()
-        localized_time = current_time.astimezone(desired_timezone)
+        # Nearby results depend on the caller's location, so only the location-free search is cached.
+        cache_key = None if nearby else search_cache.key(request)
+        if cache_key:
+            cached = search_cache.get(cache_key)
+            if cached is not None:
+                return Response(cached, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
 
         restaurant_queryset = RestaurantProfile.objects.filter(state='approved')
         item_queryset = Item.objects.all()
 
+        if nearby:
+            latitude, longitude, radius = self._get_nearby_point(request)
+            restaurant_queryset = GeoLocator.within_radius(restaurant_queryset, latitude, longitude, radius)
+            item_queryset = item_queryset.filter(restaurant__in=restaurant_queryset.values('pk'))
+
         if query:
-            restaurant_queryset = restaurant_queryset.filter(name__icontains=query)
-            item_queryset = item_queryset.filter(name__icontains=query)
+            search_backend = get_search_backend()
+            restaurant_queryset = self._search(search_backend, restaurant_queryset, query)
+            item_queryset = self._search(search_backend, item_queryset, query)
 
+        open_now = open_now_filter()
+        business_type_filter, open_filter = Q(), Q()
         if business_type:
-            restaurant_queryset = restaurant_queryset.filter(business_type__icontains=business_type)
-
+            business_type_filter = Q(business_type__icontains=business_type)
         if is_open is not None:
             if is_open.lower() == 'true':
-                restaurant_queryset = restaurant_queryset.filter(
-                    open_hour__lte=localized_time, close_hour__gte=localized_time
-                )
+                open_filter = open_now
             elif is_open.lower() == 'false':
-                restaurant_queryset = restaurant_queryset.exclude(
-                    open_hour__lte=localized_time, close_hour__gte=localized_time
+                open_filter = ~open_now
+
+        facets = facet_counts(restaurant_queryset, open_now, business_type_filter, open_filter)
+        restaurant_queryset = restaurant_queryset.filter(business_type_filter & open_filter)
+
+        item_ordering = ('-search_rank', 'pk') if query else ('pk',)
+        restaurant_ordering = ('distance', 'pk') if nearby else item_ordering
+        restaurant_paginator = SearchResultsPagination('restaurants', restaurant_ordering)
+        item_paginator = SearchResultsPagination('items', item_ordering)
+        restaurants = restaurant_paginator.paginate_queryset(restaurant_queryset.distinct(), request, view=self)
+        items = item_paginator.paginate_queryset(item_queryset.distinct(), request, view=self)
+
+        restaurant_serializer = RestaurantProfileSerializer(restaurants, many=True)
+        item_serializer = ItemSerializer(items, many=True)
+
+        data = {
+            "restaurants": restaurant_serializer.data,
+            "items": item_serializer.data,
+            "restaurants_next": restaurant_paginator.get_next_link(),
+            "restaurants_previous": restaurant_paginator.get_previous_link(),
+            "items_next": item_paginator.get_next_link(),
+            "items_previous": item_paginator.get_previous_link(),
+            "facets": facets,
+        }
+        if cache_key:
+            search_cache.set(cache_key, data)
+        return Response(data, status=status.HTTP_200_OK, headers={'X-Cache': 'MISS' if cache_key else 'BYPASS'})
+
+    @staticmethod
+    def _search(search_backend, queryset, query):
+        results = search_backend.search(queryset, query)
+        if results.exists():
+            return results
+        # Nothing matched as typed: retry with typo-tolerant name matching.
+        return search_backend.fuzzy_search(queryset, query)
+
+    def _get_nearby_point(self, request):
+        params = request.query_params
+        try:
+            radius = float(params.get('radius', self.DEFAULT_RADIUS_KM))
+            if 'latitude' in params or 'longitude' in params:
+                latitude, longitude = float(params['latitude']), float(params['longitude'])
+            else:
+                latitude, longitude = self._get_customer_location(request.user)
+        except (KeyError, ValueError):
+            raise ValidationError("'latitude', 'longitude' and 'radius' must be numbers.")
+
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValidationError("Invalid 'latitude' or 'longitude'.")
+        if not 0 < radius <= self.MAX_RADIUS_KM:
+            raise ValidationError(f"'radius' must be between 0 and {self.MAX_RADIUS_KM} km.")
+        return latitude, longitude, radius
+
+    @staticmethod
+    def _get_customer_location(user):
+        profile = getattr(user, 'customer_profile', None) if user.is_authenticated else None
+        if profile is None or profile.latitude is None or profile.longitude is None:
+            raise ValidationError("'latitude' and 'longitude' are required when no customer location is stored.")
+        return float(profile.latitude), float(profile.longitude)
+
+
+class SearchCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Hit/miss counters of the search response cache.",
+        operation_description=(
+            "Read from the process that serves the request. Unless SEARCH_CACHE_URL is a shared "
+            "backend (shared=false), every worker process has its own cache and counters."
+        ),
+        responses={
+            200: openapi.Response(
+                description="Cache counters.",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'hits': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'misses': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'hit_ratio': openapi.Schema(type=openapi.TYPE_NUMBER),
+                        'shared': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    }
                 )
+            ),
+            403: "Forbidden",
+        }
+    )
+    def get(self, request):
+        return Response({**search_cache.stats(), 'shared': search_cache.shared})
+
+    @swagger_auto_schema(
+        operation_summary="Reset the search response cache counters.",
+        responses={204: "Counters reset.", 403: "Forbidden"}
+    )
+    def delete(self, request):
+        search_cache.reset_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-        restaurant_serializer = RestaurantProfileSerializer(restaurant_queryset.distinct(), many=True)
-        item_serializer = ItemSerializer(item_queryset.distinct(), many=True)
+class AutocompleteView(APIView):
+    DEFAULT_LIMIT = 5
+    MAX_LIMIT = 20
+
+    @swagger_auto_schema(
+        operation_summary="Suggest restaurant and item names for a search prefix.",
+        operation_description="Served from an in-memory index of approved restaurants and available items.",
+        manual_parameters=[
+            openapi.Parameter(
+                'prefix',
+                openapi.IN_QUERY,
+                description="Beginning of any word of the name.",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description=f"Maximum suggestions per list (default {DEFAULT_LIMIT}, max {MAX_LIMIT}).",
+                type=openapi.TYPE_INTEGER
+            ),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Restaurant and item suggestions.",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'restaurants': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT)
+                        ),
+                        'items': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_OBJECT)
+                        ),
+                    }
+                )
+            ),
+            400: "Invalid request parameters.",
+        }
+    )
+    def get(self, request):
+        prefix = request.query_params.get('prefix', '')
+        try:
+            limit = min(int(request.query_params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            raise ValidationError("Invalid 'limit' parameter. It must be a positive integer.")
 
+        suggestions = suggestion_index.suggest(prefix, limit)
         return Response(
             {
-                "restaurants": restaurant_serializer.data,
-                "items": item_serializer.data,
+                "restaurants": [
+                    {"id": restaurant_id, "name": name}
+                    for restaurant_id, (name, _, _) in suggestions[RESTAURANT].items()
+                ],
+                "items": [
+                    {"item_id": item_id, "name": name, "restaurant": restaurant_id}
+                    for item_id, (name, restaurant_id, _) in suggestions[ITEM].items()
+                ],
             },
             status=status.HTTP_200_OK
         )
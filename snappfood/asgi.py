@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'snappfood.settings')
 
 application = get_asgi_application()
+
+if settings.DEBUG:
+    # Serve static files (admin, API docs) the way runserver did in development.
+    application = ASGIStaticFilesHandler(application)
@@ -100,6 +100,23 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default; point the URLs at a shared backend (e.g. redis://) in production.
+# With local memory every process has its own search cache and hit/miss counters: the
+# search_cache_stats command then only sees its own (empty) process, and the stats have to be
+# read from the server at /api/restaurant/search-cache/stats.
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    'search': env.cache('SEARCH_CACHE_URL', default='locmemcache://search'),
+}
+CACHES['search'].setdefault('TIMEOUT', env.int('SEARCH_CACHE_TIMEOUT', default=30))
+if CACHES['search']['BACKEND'].endswith('LocMemCache'):
+    # LocMemCache evicts least recently used entries beyond MAX_ENTRIES; shared backends do their own LRU.
+    CACHES['search']['OPTIONS'] = {'MAX_ENTRIES': env.int('SEARCH_CACHE_MAX_ENTRIES', default=5000)}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -156,4 +173,20 @@ SWAGGER_SETTINGS = {
 CORS_ALLOW_ALL_ORIGINS = True
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+THUMBNAIL_WORKERS = env.int('THUMBNAIL_WORKERS', default=2)
+
+# Serve restaurant/item scores from the stored review aggregates. When disabled, list
+# endpoints compute live scores with one grouped aggregate per page.
+USE_STORED_SCORES = env.bool('USE_STORED_SCORES', default=True)
+
+# How long, in seconds, the response to a request with an Idempotency-Key header is replayed.
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60)
+
+# Pub/sub backend for the live order streams; see order/broker.py for the interface. The
+# in-process broker only works with a single server process.
+ORDER_EVENT_BROKER = env(
+    'ORDER_EVENT_BROKER',
+    default='order.broker.PostgresBroker' if 'postgresql' in DATABASES['default']['ENGINE']
+    else 'order.broker.InProcessBroker',
+)